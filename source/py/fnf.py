@@ -5,6 +5,7 @@
 import os
 from typing import List, Tuple
 from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
 import subprocess
 import datetime
 import inspect
@@ -16,6 +17,18 @@ import re
 import requests
 import shutil
 import traceback
+import bisect
+import random
+import time
+from array import array
+import tracemalloc
+import contextlib
+import io
+import tempfile
+import hashlib
+import importlib.util
+import builtins
+import marshal
 
 #--------------------------------------------------------------------------------------------------
 # logging
@@ -75,12 +88,24 @@ s_cwd = os.getcwd()
 global s_caller_enabled
 s_caller_enabled = True
 
+# where a grammar rule was written: just the code object and line, formatted only when shown
+class CallerContext:
+    __slots__ = ('code', 'lineno')
+    def __init__(self, code, lineno: int):
+        self.code = code
+        self.lineno = lineno
+
+    def where(self) -> str:
+        return f"{self.code.co_filename.replace(s_cwd, "")}:{self.lineno}"
+
+    def __str__(self):
+        return f"    ◀︎ {console_grey()}{self.where()}{console_normal()}"
+
+# the caller of the function that calls caller_context(); cost doesn't depend on stack depth
 def caller_context():
     if not s_caller_enabled: return ""
-    frame = inspect.currentframe()
-    frame = inspect.getouterframes(frame)[2]
-    hyperlink = f"    ◀︎ {console_grey()}{frame.filename.replace(s_cwd, "")}:{frame.lineno}{console_normal()}"
-    return hyperlink
+    frame = sys._getframe(2)
+    return CallerContext(frame.f_code, frame.f_lineno)
 
 #--------------------------------------------------------------------------------------------------
 # # file system low-level
@@ -95,32 +120,55 @@ def writeTextFile(path: str, text: str):
     with open(path, "w") as file:
         file.write(text)
 
+# writes (data) through a temporary file of its own in the same folder, so nobody sees (path) half-written
+def writeFileAtomically(path: str, data):
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=folder, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb" if isinstance(data, bytes) else "w") as file: file.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(OSError): os.remove(tmp)
+        raise
+
 def currentWorkingDirectory() -> str:
     return os.getcwd()
 
-def getCreationTimestamp(file_path):
+# the files and subfolders listed in (folder); the listing says which is which, so nothing is stat'ed
+# symlinked folders count as neither (like os.walk, we don't follow them); unreadable folders are empty
+def listFolder(folder: str) -> Tuple[List[str], List[str]]:
+    files, folders = [], []
     try:
-        stat = os.stat(file_path)
-        return stat.st_birthtime
-    except AttributeError:
-        # This may not be available on all systems
-        return None
-
-def scanFolder(folder, ext: str) -> List[str]:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if not entry.is_dir(): files.append(entry.path)
+                elif not entry.is_symlink(): folders.append(entry.path)
+    except OSError:
+        pass
+    return files, folders
+
+# all files under (folder) ending in (ext), relative to the cwd if they're inside it, sorted by path
+# path order is the same on every machine and checkout, unlike creation times (which linux doesn't even have)
+# with (threads) > 1, each level of subfolders is listed in parallel
+def scanFolder(folder, ext: str, threads: int=0) -> List[str]:
     cwd = currentWorkingDirectory()
+    if folder.startswith(cwd + "/"): folder = folder[len(cwd)+1:]
     filesFound = []
-    for root, dirs, files in os.walk(folder):
-        for file in files:
-            if file.endswith(ext):
-                filesFound.append(os.path.join(root, file))
-    # sort files into ascending order of creation-date
-    filesFound.sort(key=lambda x: getCreationTimestamp(x))
-    filesFound= [file.replace(cwd+"/", "") for file in filesFound]
-    log("filesFound:")
-    for file in filesFound:
-        dateAsString = os.path.getctime(file)
-        humanReadableDate = datetime.datetime.fromtimestamp(dateAsString).isoformat()
-        log(f"  {file} : {humanReadableDate}")
+    pool = ThreadPoolExecutor(threads) if threads > 1 else None
+    level = [folder]
+    while len(level) > 0:
+        listings = pool.map(listFolder, level) if pool else [listFolder(f) for f in level]
+        level = []
+        for files, folders in listings:
+            filesFound += [file for file in files if file.endswith(ext)]
+            level += folders
+    if pool: pool.shutdown()
+    filesFound.sort()
+    if log_enabled:
+        log("filesFound:")
+        for file in filesFound:
+            log(f"  {file} : {datetime.datetime.fromtimestamp(os.path.getmtime(file)).isoformat()}")
     return filesFound
 
 #---------------------------------------------------------------------------------
@@ -203,6 +251,8 @@ class SourceFile:
     def __init__(self, path: str, text: str=""):
         self.path = path
         self.text = readTextFile(path) if path else text.strip()
+        self._lineStarts = None         # char index of the start of each line, built on first use
+        self._lineStartsText = None     # the text _lineStarts was built from
 
     def numberedText(self):
         lines = self.text.split('\n')
@@ -211,14 +261,21 @@ class SourceFile:
             out += f"{i+1:3} {lines[i]}\n"
         return out
     
+    def lineStarts(self) -> List[int]:
+        if self._lineStartsText is not self.text:
+            self._lineStarts = [0] + [m.end() for m in re.finditer('\n', self.text)]
+            self._lineStartsText = self.text
+        return self._lineStarts
+
+    # line and column of a char index: column counts from the previous '\n' (or from 0 on line 1)
+    def lineColumn(self, iChar: int) -> Tuple[int, int]:
+        starts = self.lineStarts()
+        line = bisect.bisect_right(starts, iChar)
+        iCr = starts[line-1] - 1 if line > 1 else 0
+        return line, iChar - iCr
+
     def findLocation(self, iChar: int) -> 'SourceLocation':
-        line = 1
-        iCr = 0
-        for i in range(0, iChar):
-            if self.text[i] == '\n': 
-                iCr = i
-                line += 1
-        column = iChar - iCr
+        line, column = self.lineColumn(iChar)
         return SourceLocation(self.path, line, column)
     
 class SourceLocation:
@@ -265,20 +322,14 @@ class Lex:
         return self.val[0].isalpha() or self.val[0] == '_'
     
     def location(self):
-        path = self.source.path if self.source and self.source.path else ""
-        line = 1
-        iCr = 0
-        if self.source:
-            for i in range(0, self.iStart):
-                if self.source.text[i] == '\n': 
-                    iCr = i
-                    line += 1
-        return SourceLocation(path, line, self.iStart - iCr)
+        source = self.source
+        if not source: return SourceLocation("", 1, self.iStart)
+        line, column = source.lineColumn(self.iStart)
+        return SourceLocation(source.path if source.path else "", line, column)
 
-# lexer takes source range and turns it into a list of lexemes
+# lexer_charwise is the original per-character lexer; kept as the reference for lexer() below
 # handles C-style ("{") or python-style (":") indentation
-def lexer(ranges: SourceRange, indentChar='{') -> List[Lex]:
-    safeCount = 10000
+def lexer_charwise(ranges: SourceRange, indentChar='{') -> List[Lex]:
     out : List[Lex] = []
     inQuotes : bool = False
     whichQuote : str = ""
@@ -290,8 +341,10 @@ def lexer(ranges: SourceRange, indentChar='{') -> List[Lex]:
     lineIndentLevel = 0
     for range in ranges:
         i = range.iStart
-        while i < range.iEnd and safeCount > 0:
-            safeCount -= 1
+        iPrev = i - 1
+        while i < range.iEnd:
+            if i <= iPrev: raise RuntimeError(f"lexer stuck at {range.source.findLocation(i)}")
+            iPrev = i
             c = range.source.text[i]
             cp = range.source.text[i-1] if i > 0 else ""
             cn = range.source.text[i+1] if i < range.iEnd - 1 else ""
@@ -352,18 +405,342 @@ def lexer(ranges: SourceRange, indentChar='{') -> List[Lex]:
                                         out.append(Lex(range.source, i, j, '{newline}'))
                                 lineIndentLevel = indentLevel
                                 startOfLine = False
-                                i = j - 1    
+                                i = j - 1
             i = i + 1
     return out
 
+# master regex: leading whitespace, then one group per kind of token; m.lastindex says which kind matched
+LEX_STRING, LEX_ID, LEX_NUMBER, LEX_PUNCTUATION, LEX_OPERATOR, LEX_LINE, LEX_OPEN, LEX_CLOSE, LEX_OTHER = range(1, 10)
+
+s_lex_patterns = {}
+
+def lexer_pattern(indentChar: str):
+    pattern = s_lex_patterns.get(indentChar)
+    if pattern: return pattern
+    quoted = "|".join(f"{q}(?:[^{q}]|(?<=\\\\){q})*+{q}" for q in '`"\'')
+    whitespace = "[ \\t\\r]*" if indentChar == ":" else "[ \\t\\r\\n]*"
+    never = "((?!))"
+    line = "\\n( *)" if indentChar == ":" else never
+    braces = "(\\{)|(\\})" if indentChar == "{" else never + "|" + never
+    pattern = re.compile(whitespace + "(?:" + "|".join([
+        f"({quoted})",                      # LEX_STRING
+        "([A-Za-z_]\\w*)",                  # LEX_ID
+        "([0-9]+)",                         # LEX_NUMBER
+        "([\\[\\]():;,.])",                 # LEX_PUNCTUATION
+        "([!@$%^&*\\-+=/?<>~]{1,2})",       # LEX_OPERATOR
+        line,                               # LEX_LINE
+        braces,                             # LEX_OPEN, LEX_CLOSE
+        "(.)",                              # LEX_OTHER
+        "\\Z"]) + ")", re.DOTALL)
+    s_lex_patterns[indentChar] = pattern
+    return pattern
+
+s_quote_closers = { q : re.compile(f"(?:[^{q}]|(?<=\\\\){q})*+{q}", re.DOTALL) for q in '`"\'' }
+
+# token kinds: indentation markers stand in for source text, the others are their source text
+TOKEN_INDENT, TOKEN_UNDENT, TOKEN_NEWLINE, TOKEN_ID, TOKEN_NUMBER, TOKEN_STRING, TOKEN_PUNCTUATION, TOKEN_OPERATOR = range(1, 9)
+s_token_vals = [None, '{indent}', '{undent}', '{newline}', None, None, None, None, None]
+
+# token kind for each master-regex group (LEX_LINE and LEX_OTHER are worked out as they're found)
+s_group_tokens = [None, TOKEN_STRING, TOKEN_ID, TOKEN_NUMBER, TOKEN_PUNCTUATION, TOKEN_OPERATOR, None, TOKEN_INDENT, TOKEN_UNDENT, None]
+
+# token kind of a lexeme value, for lexemes that didn't come from the lexer
+def token_kind(val: str) -> int:
+    if val == '{indent}': return TOKEN_INDENT
+    if val == '{undent}': return TOKEN_UNDENT
+    if val == '{newline}': return TOKEN_NEWLINE
+    c = val[0] if val else ' '
+    if c in '`\"\'': return TOKEN_STRING
+    if c.isalpha() or c == '_': return TOKEN_ID
+    if c.isdigit(): return TOKEN_NUMBER
+    if c in '[]():;,.': return TOKEN_PUNCTUATION
+    return TOKEN_OPERATOR
+
+# every distinct word (anything but a string) gets a small integer id, so parsers can compare ints
+s_word_ids = {}
+s_words = [None]                        # id 0 means "not a word"
+
+def word_id(word: str) -> int:
+    wid = s_word_ids.get(word)
+    if wid is None:
+        wid = len(s_words)
+        s_word_ids[word] = wid
+        s_words.append(word)
+    return wid
+
+WORD_INDENT, WORD_UNDENT, WORD_NEWLINE = word_id('{indent}'), word_id('{undent}'), word_id('{newline}')
+
+# brackets: any closer closes the innermost opener, whatever its kind
+s_open_ids = frozenset([word_id("("), word_id("["), WORD_INDENT])
+s_close_ids = frozenset([word_id(")"), word_id("]"), WORD_UNDENT])
+
+# matches[i] is the index of the closer for the opener at i (len(ids) if it's never closed); 0 for everything else
+def bracket_matches(ids) -> array:
+    matches = array('I', bytes(4 * len(ids)))
+    opened = []
+    for i, wid in enumerate(ids):
+        if wid in s_open_ids: opened.append(i)
+        elif wid in s_close_ids and opened: matches[opened.pop()] = i
+    for i in opened: matches[i] = len(ids)
+    return matches
+
+# lex_spans yields (source, iStart, iEnd, kind) for each lexeme in a list of source ranges, in linear time
+# handles C-style ("{") or python-style (":") indentation
+# one regex match per token; produces exactly the same lexemes as lexer_charwise, quirks included
+# there's no size limit: instead, every step must move forward through the text
+def lex_spans(ranges: List[SourceRange], indentChar='{'):
+    match = lexer_pattern(indentChar).match
+    startOfLine = indentChar == ":"     # only the very first line can start without a '\n'
+    lineIndentLevel = 0
+    openQuote = None                    # (quote char, start) of a string still open at the end of a range
+    held = None                         # a ':' that is dropped if the next lexeme is {indent}/{undent}/{newline}
+    holdColons = indentChar == ":"
+    for range in ranges:
+        source = range.source
+        text = source.text
+        i = range.iStart
+        end = range.iEnd
+        if openQuote:
+            m = s_quote_closers[openQuote[0]].match(text, i, end)
+            if not m: continue
+            if held: yield held; held = None
+            yield (source, openQuote[1], m.end(), TOKEN_STRING)
+            openQuote = None
+            i = m.end()
+        while startOfLine and i < end:
+            # leading strings don't count; a leading run of spaces counts as the first line's indent
+            c = text[i]
+            if c in '`\"\'':
+                m = s_quote_closers[c].match(text, i+1, end)
+                if not m:
+                    openQuote = (c, i)
+                    i = end
+                    break
+                yield (source, i, m.end(), TOKEN_STRING)
+                i = m.end()
+                continue
+            startOfLine = False
+            if c == ' ':
+                j = i
+                while j < end and text[j] == ' ': j += 1
+                lineIndentLevel = (j - i) // 4
+                yield (source, i, j, TOKEN_INDENT if lineIndentLevel > 0 else TOKEN_NEWLINE)
+                i = j
+        while i < end:
+            m = match(text, i, end)
+            kind = m.lastindex
+            if kind is None: break          # only whitespace left
+            iStart = m.start(kind)
+            if m.end() <= i: raise RuntimeError(f"lexer stuck at {source.findLocation(i)}")
+            i = m.end()
+            token = s_group_tokens[kind]
+            if kind == LEX_ID or kind == LEX_PUNCTUATION or kind == LEX_STRING:
+                pass
+            elif kind == LEX_NUMBER:
+                while i < end and text[i].isdigit(): i += 1
+            elif kind == LEX_OPERATOR:
+                if i == end and i - iStart == 1: i += 1    # charwise lexer reads one past the end here
+            elif kind == LEX_LINE:
+                held = None
+                indentLevel = (i - iStart) // 4
+                if indentLevel > lineIndentLevel: token = TOKEN_INDENT
+                elif indentLevel < lineIndentLevel: token = TOKEN_UNDENT
+                else: token = TOKEN_NEWLINE
+                lineIndentLevel = indentLevel
+            elif kind == LEX_OPEN or kind == LEX_CLOSE:
+                pass
+            else:
+                c = text[iStart]
+                if c in '`\"\'':
+                    openQuote = (c, iStart)   # no closing quote in this range
+                    break
+                elif c.isalpha():
+                    while i < end and (text[i].isalnum() or text[i] == '_'): i += 1
+                    token = TOKEN_ID
+                elif c.isdigit():
+                    while i < end and text[i].isdigit(): i += 1
+                    token = TOKEN_NUMBER
+                else:
+                    continue
+            lex = (source, iStart, i, token)
+            if held: yield held; held = None
+            if kind == LEX_PUNCTUATION and holdColons and text[iStart] == ":":
+                held = lex
+            else:
+                yield lex
+    if held: yield held
+
+# lex_stream yields the lexemes of a list of source ranges one at a time
+def lex_stream(ranges: List[SourceRange], indentChar='{'):
+    for source, iStart, iEnd, token in lex_spans(ranges, indentChar):
+        yield Lex(source, iStart, iEnd, s_token_vals[token])
+
+# lexer takes source range and turns it into a list of lexemes
+def lexer(ranges: List[SourceRange], indentChar='{') -> List[Lex]:
+    return [Lex(source, iStart, iEnd, s_token_vals[token]) for source, iStart, iEnd, token in lex_spans(ranges, indentChar)]
+
+#---------------------------------------------------------------------------------
+# TokenBuffer stores a file's lexemes as columns: start, end, kind and word id of each token
+# strings are sliced from the source text only when asked for
+
+class TokenBuffer:
+    def __init__(self, source: SourceFile):
+        self.source = source
+        self.starts = array('I')
+        self.ends = array('I')
+        self.kinds = array('I')
+        self.ids = array('I')
+        self.matches = array('I')       # bracket table, as bracket_matches(ids)
+
+    def append(self, iStart: int, iEnd: int, kind: int, wid: int):
+        self.starts.append(iStart)
+        self.ends.append(iEnd)
+        self.kinds.append(kind)
+        self.ids.append(wid)
+        self.matches.append(0)
+
+    def val(self, i: int) -> str:
+        wid = self.ids[i]
+        if wid: return s_words[wid]
+        return self.source.text[self.starts[i]:self.ends[i]]
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, i: int) -> 'TokenView':
+        if i < 0: i += len(self.kinds)
+        if i < 0 or i >= len(self.kinds): raise IndexError("token index out of range")
+        return TokenView(self, i)
+
+    def __iter__(self):
+        for i in range(0, len(self.kinds)):
+            yield TokenView(self, i)
+
+    def __str__(self):
+        return "[" + ", ".join(self.val(i) for i in range(0, len(self.kinds))) + "]"
+
+    def __repr__(self):
+        return self.__str__()
+
+# TokenView looks like a Lex, but reads everything from its TokenBuffer
+class TokenView:
+    __slots__ = ('buffer', 'index')
+    def __init__(self, buffer: TokenBuffer, index: int):
+        self.buffer = buffer
+        self.index = index
+
+    @property
+    def source(self): return self.buffer.source
+    @property
+    def iStart(self): return self.buffer.starts[self.index]
+    @property
+    def iEnd(self): return self.buffer.ends[self.index]
+    @property
+    def val(self): return self.buffer.val(self.index)
+
+    def __str__(self):
+        return self.val
+
+    def __repr__(self):
+        return self.val
+
+    is_id = Lex.is_id
+    location = Lex.location
+
+# TokenRange stands in for the list of lexemes [iStart, iEnd) without copying them
+# it indexes, iterates and prints like that list; text() is the source text it covers
+class TokenRange:
+    __slots__ = ('lexemes', 'iStart', 'iEnd')
+    def __init__(self, lexemes, iStart: int, iEnd: int):
+        self.lexemes = lexemes
+        self.iStart = iStart
+        self.iEnd = iEnd
+
+    def __len__(self) -> int:
+        return self.iEnd - self.iStart
+
+    def __getitem__(self, i):
+        if isinstance(i, slice): return [self.lexemes[self.iStart + j] for j in range(*i.indices(len(self)))]
+        if i < 0: i += len(self)
+        if i < 0 or i >= len(self): raise IndexError("TokenRange index out of range")
+        return self.lexemes[self.iStart + i]
+
+    def __iter__(self):
+        lexemes = self.lexemes
+        for i in range(self.iStart, self.iEnd):
+            yield lexemes[i]
+
+    def text(self) -> str:
+        if self.iEnd <= self.iStart: return ""
+        first, last = self.lexemes[self.iStart], self.lexemes[self.iEnd-1]
+        return first.source.text[first.iStart:last.iEnd]
+
+    def __str__(self):
+        return "[" + ", ".join(str(lex) for lex in self) + "]"
+
+    def __repr__(self):
+        return self.__str__()
+
+# true for a Lex or anything standing in for one
+def is_lex(obj) -> bool:
+    return isinstance(obj, (Lex, TokenView))
+
+# tokenise: like lexer, but fills a TokenBuffer (all ranges must come from the same source)
+# the bracket table is filled in as we go
+# (ranges) can be any iterable, such as extract_ranges(source); say which (source) they come from to stream them,
+# otherwise they're read into a list first to find it
+def tokenise(ranges: List[SourceRange], indentChar='{', source: SourceFile=None) -> TokenBuffer:
+    if source is None:
+        ranges = [range for range in ranges]
+        source = ranges[0].source if len(ranges) > 0 else None
+    buffer = TokenBuffer(source)
+    starts, ends, kinds, ids, matches = buffer.starts, buffer.ends, buffer.kinds, buffer.ids, buffer.matches
+    opened = []
+    for source, iStart, iEnd, token in lex_spans(ranges, indentChar):
+        if source is not buffer.source: raise ValueError("tokenise: all ranges must share one source file")
+        starts.append(iStart)
+        ends.append(iEnd)
+        kinds.append(token)
+        matches.append(0)
+        if token == TOKEN_STRING: ids.append(0)
+        else:
+            val = s_token_vals[token] or source.text[iStart:iEnd]
+            wid = s_word_ids.get(val) or word_id(val)
+            ids.append(wid)
+            if wid in s_open_ids: opened.append(len(ids) - 1)
+            elif wid in s_close_ids and opened: matches[opened.pop()] = len(ids) - 1
+    for i in opened: matches[i] = len(ids)
+    return buffer
+
 #---------------------------------------------------------------------------------
 # parse/print helpers
 
-# Reader reads forward in a lexeme-list
+# Reader reads forward in a lexeme-list (or TokenBuffer)
+# kinds[i] and ids[i] are the token kind and word id of lexeme i, for parsers to compare; matches is the bracket table
+# packrat=True remembers every (parser, position) result, so backtracking never parses anything twice
+# ranges=True makes id/enum/upto return TokenRanges into (lexemes) rather than lists of lexemes
 class Reader:
-    def __init__(self, lexemes: List[Lex]):
+    def __init__(self, lexemes: List[Lex], packrat: bool=False, ranges: bool=False):
         self.lexemes = lexemes
+        self.ranges = ranges
         self.i = 0
+        self.n = len(lexemes)
+        self.memo = {} if packrat else None
+        self.memoHits = 0
+        self.memoMisses = 0
+        self.memoSkipped = 0            # tokens that hits didn't have to parse again
+        self.failure = Error("", self)  # the Error that fail() fills in
+        self.farthest = -1              # the furthest token any parser failed at...
+        self.expecting = {}             # ...and what was expected there: expected_id => grammar context
+        if isinstance(lexemes, TokenBuffer):
+            self.kinds = lexemes.kinds
+            self.ids = lexemes.ids
+            self.matches = lexemes.matches
+        else:
+            vals = [str(lex) for lex in lexemes]
+            self.kinds = array('I', [token_kind(val) for val in vals])
+            self.ids = array('I', [0 if kind == TOKEN_STRING else word_id(val) for kind, val in zip(self.kinds, vals)])
+            self.matches = bracket_matches(self.ids)
 
     def peek(self) -> Lex:
         return self.lexemes[self.i] if self.i < len(self.lexemes) else None
@@ -377,7 +754,40 @@ class Reader:
         lex = self.lexemes[iLex]
         return lex.location()
 
+    # the parser expected (expectedId) at the current position: fills in and returns this reader's one Error
+    def fail(self, expectedId: int, context) -> 'Error':
+        i = self.i
+        if i >= self.farthest: self.expect(i, expectedId, context)
+        failure = self.failure
+        failure.expectedId = expectedId
+        failure.iLex = i
+        failure.context = context
+        return failure
+
+    # farthest-failure tracking: remember what was expected at the furthest token reached
+    def expect(self, i: int, expectedId: int, context):
+        if i > self.farthest:
+            self.farthest = i
+            self.expecting = { expectedId: context }
+        elif not expectedId in self.expecting: self.expecting[expectedId] = context
+
+    # one Error for everything expected at the farthest failure, or None if nothing failed
+    def diagnostic(self) -> 'Error':
+        if self.farthest < 0: return None
+        error = self.failure.copy()
+        error.iLex = self.farthest
+        error.expected = " or ".join(s_expected[eid] for eid in self.expecting)
+        error.context = next(iter(self.expecting.values()))
+        return error
+
+    def memo_stats(self) -> str:
+        total = self.memoHits + self.memoMisses
+        rate = 100 * self.memoHits / total if total else 0
+        return f"packrat: {self.memoHits} hits, {self.memoMisses} misses ({rate:.0f}% hits), {self.memoSkipped} tokens skipped"
+
 # Writer writes into a List[Lex]
+# printers that might have to take back what they wrote take a mark() first,
+# then either rollback() to it or release() it once what they wrote is good
 class Writer:
     def __init__(self):
         self.lexemes = []
@@ -385,17 +795,153 @@ class Writer:
     def write(self, lex: Lex):
         self.lexemes.append(lex)
 
+    def mark(self) -> int:
+        return len(self.lexemes)
+
+    def rollback(self, mark: int):
+        del self.lexemes[mark:]
+
+    def release(self, mark: int):
+        pass
+
+# TextWriter formats straight into a text stream (io.StringIO, open file) as the printers write
+# {indent}/{undent}/{newline} lay out lines for the language: braces for "{" languages, ':' and indentation for python
+# text is held back until the outermost mark is released (or finish()), so rollback can drop it
+s_quotes = "\"'`"
+s_string_prefixes = frozenset(['f', 'r', 'b', 'u', 'rb', 'br', 'fr', 'rf', 'u8', 'l'])   # f"..", u8"..", L".." etc
+
+class TextWriter:
+    def __init__(self, out, language: 'Language'):
+        self.out = out
+        self.braces = language.indentChar() == "{"
+        self.pending = []           # text not yet written to out
+        self.emit = self.pending.append
+        self.nMarks = 0
+        self.depth = 0              # indentation level
+        self.parens = 0             # open ( and [ since the last line break
+        self.lineStart = True
+        self.prev = ""              # previous word written
+
+    def write(self, lex: Lex):
+        word = str(lex)
+        if word == '{indent}':
+            self.emit(" {\n" if self.braces else ":\n")
+            self.depth += 1
+            self.lineStart = True
+            self.parens = 0
+        elif word == '{undent}':
+            if not self.lineStart: self.emit("\n")
+            self.depth = max(0, self.depth - 1)
+            if self.braces: self.emit("    " * self.depth + "}\n")
+            self.lineStart = True
+            self.parens = 0
+        elif word == '{newline}':
+            if not self.lineStart: self.emit("\n")
+            self.lineStart = True
+            self.parens = 0
+        else:
+            if self.lineStart: self.emit("    " * self.depth)
+            elif self.spaced(word): self.emit(" ")
+            self.emit(word)
+            self.lineStart = False
+            if word in ['(', '[']: self.parens += 1
+            elif word in [')', ']']: self.parens = max(0, self.parens - 1)
+            elif word == ';' and self.braces and self.parens == 0:
+                self.emit("\n")
+                self.lineStart = True
+        self.prev = word
+
+    # is there a space between the previous word and (word)?
+    def spaced(self, word: str) -> bool:
+        if word in [',', ';', ')', ']', '.', ':'] or self.prev in ['(', '[', '.']: return False
+        if word[0] in s_quotes and self.prev.lower() in s_string_prefixes: return False
+        if word in ['(', '['] and (self.prev in [')', ']'] or self.prev[0].isalnum() or self.prev[0] == '_'): return False
+        return True
+
+    def mark(self):
+        self.nMarks += 1
+        return (len(self.pending), self.depth, self.parens, self.lineStart, self.prev)
+
+    def rollback(self, mark):
+        iPending, self.depth, self.parens, self.lineStart, self.prev = mark
+        del self.pending[iPending:]
+        self.release(mark)
+
+    def release(self, mark):
+        self.nMarks -= 1
+        if self.nMarks == 0: self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.out.write("".join(self.pending))
+            self.pending.clear()
+
+    # end the last line and write out everything held back
+    def finish(self):
+        if not self.lineStart: self.emit("\n")
+        self.lineStart = True
+        self.flush()
+
+# the text TextWriter makes of a list of lexemes, for comparison
+def format_lexemes(lexemes: List[Lex], language: 'Language') -> str:
+    out = io.StringIO()
+    writer = TextWriter(out, language)
+    for lex in lexemes: writer.write(lex)
+    writer.finish()
+    return out.getvalue()
+
+# one shared Lex per literal word the printers write (keywords, separators, {indent} etc)
+s_literal_lexemes = {}
+
+def literal_lex(word: str) -> Lex:
+    lex = s_literal_lexemes.get(word)
+    if lex is None:
+        lex = Lex(SourceFile(None, word), 0, len(word))
+        s_literal_lexemes[word] = lex
+    return lex
+
 def is_reader(obj):
     return isinstance(obj, Reader)
 
-# Error just holds a message and a point in the source file
+# every distinct "expected ..." message gets a small integer id, made when the grammar is built
+s_expected_ids = {}
+s_expected = []
+
+def expected_id(expected: str) -> int:
+    eid = s_expected_ids.get(expected)
+    if eid is None:
+        eid = len(s_expected)
+        s_expected_ids[expected] = eid
+        s_expected.append(expected)
+    return eid
+
+# Error just holds what was expected (as an expected_id) and a point in the lexemes
+# the message text and source location are only worked out when someone asks for them
+# failing parsers return reader.fail(), which reuses one Error per reader: keep one with copy()
 class Error:
+    __slots__ = ('expectedId', 'reader', 'iLex', 'context')
     def __init__(self, expected: str, reader: Reader, context=""):
-        self.context = context
-        self.expected = expected
+        self.expectedId = expected_id(expected)
         self.reader = reader
         self.iLex = reader.i
-        self.location = reader.location(self.iLex)
+        self.context = context
+
+    @property
+    def expected(self) -> str:
+        return s_expected[self.expectedId]
+
+    @expected.setter
+    def expected(self, expected: str):
+        self.expectedId = expected_id(expected)
+
+    @property
+    def location(self) -> SourceLocation:
+        return self.reader.location(self.iLex)
+
+    def copy(self) -> 'Error':
+        error = Error.__new__(Error)
+        error.expectedId, error.reader, error.iLex, error.context = self.expectedId, self.reader, self.iLex, self.context
+        return error
 
     def __str__(self):
         val = str(self.reader.lexemes[self.iLex]) if self.iLex < len(self.reader.lexemes) else "eof"
@@ -409,13 +955,14 @@ class Error:
         lenLex = len(str(lex))
         text = lex.source.text
         lines = text.split('\n')[:-1]
+        location = self.location
         out = f"{console_grey()}"
-        for i in range(max(0,self.location.line -3), min(self.location.line + 2, len(lines))):
+        for i in range(max(0,location.line -3), min(location.line + 2, len(lines))):
             line = lines[i]
-            if i == self.location.line-1:
-                before = line[:self.location.column-1]
-                mid = line[self.location.column-1:self.location.column-1+lenLex]
-                after = line[self.location.column-1+lenLex:]
+            if i == location.line-1:
+                before = line[:location.column-1]
+                mid = line[location.column-1:location.column-1+lenLex]
+                after = line[location.column-1+lenLex:]
                 out += f"{i+1:3} {before}{console_normal()}{console_grey_background()}{mid}{console_normal()}{console_grey()}{after}" + "\n"
             else:
                 out += f"{i+1:3} {line}" + "\n"
@@ -433,9 +980,6 @@ def err(obj) -> bool:
 
 # combine multiple errors
 def combine_errors(errors: List[Error]) -> Error:
-    print("combine_errors:")
-    for error in errors:
-        print("  ", error)
     # first find the latest one
     latest = errors[0]
     for error in errors:
@@ -449,98 +993,416 @@ def combine_errors(errors: List[Error]) -> Error:
     # now combine all the 'expecteds' into an "or" string
     expecteds = [error.expected for error in same_point]
     expected = " or ".join(expecteds)
-    # now return a new error with the combined expecteds
-    latest.expected = expected
-    return latest
+    # now return a new error with the combined expecteds (the originals may be memoised)
+    combined = latest.copy()
+    combined.expected = expected
+    return combined
+
+# the reporter: the one place parse errors get printed
+def report_error(path: str, error: Error, out=None):
+    out = out or sys.stdout
+    report_problem(path, error, out)
+    if error.iLex < len(error.reader.lexemes): print(error.show_source(), file=out)
+
+# ... and problems with a file that aren't parse errors
+def report_problem(path: str, message, out=None):
+    print(f"Error in {path}: {message}", file=out or sys.stdout)
+
+# packrat: returns the remembered result of (parser) at this position, or parses and remembers it
+def parse_memo(reader: Reader, parser, parse_fn, *args):
+    memo = reader.memo
+    if memo is None: return parse_fn(reader, *args)
+    key = (parser, reader.i)
+    hit = memo.get(key)
+    if hit:
+        reader.memoHits += 1
+        reader.memoSkipped += hit[1] - reader.i
+        reader.i = hit[1]
+        return hit[0]
+    reader.memoMisses += 1
+    result = parse_fn(reader, *args)
+    if result is reader.failure: result = result.copy()
+    memo[key] = (result, reader.i)
+    return result
+
+# First is the FIRST set of a parser: the word ids and token kinds it can start with
+# nullable parsers can succeed without reading anything; 'anything' means it could start with any token
+# every parser carries its First as (parser.first), worked out when the grammar is built
+class First:
+    def __init__(self, words=frozenset(), kinds=frozenset(), nullable: bool=False, anything: bool=False):
+        self.words = words
+        self.kinds = kinds
+        self.nullable = nullable
+        self.anything = anything
+
+    def could_start(self, kind: int, wid: int) -> bool:
+        return self.anything or self.nullable or wid in self.words or kind in self.kinds
+
+    def __str__(self):
+        words = sorted(s_words[wid] for wid in self.words)
+        out = f"{words}"
+        if len(self.kinds) > 0: out += f" kinds {sorted(self.kinds)}"
+        if self.nullable: out += " nullable"
+        if self.anything: out += " anything"
+        return out
+
+    def __repr__(self):
+        return self.__str__()
+
+s_first_anything = First(nullable=True, anything=True)
+
+# FIRST set of any parser; hand-written parser fns could start with anything
+def first_of(fn) -> First:
+    return getattr(fn, 'first', s_first_anything)
+
+def first_of_alternatives(fns) -> First:
+    firsts = [first_of(fn) for fn in fns]
+    return First(frozenset().union(*[f.words for f in firsts]), frozenset().union(*[f.kinds for f in firsts]),
+                 any(f.nullable for f in firsts), any(f.anything for f in firsts))
+
+def first_of_sequence(fns) -> First:
+    words, kinds, anything = frozenset(), frozenset(), False
+    for fn in fns:
+        first = first_of(fn)
+        words, kinds, anything = words | first.words, kinds | first.kinds, anything or first.anything
+        if not first.nullable: return First(words, kinds, False, anything)
+    return First(words, kinds, True, anything)
+
+# the alternatives (fns) whose FIRST sets admit the next token, in order; at eof, all of them
+# (candidates) caches the answer per word id (or -kind, for strings)
+def first_candidates(reader: Reader, fns, firsts: List[First], candidates: dict):
+    i = reader.i
+    if i >= reader.n: return fns
+    wid = reader.ids[i]
+    key = wid if wid else -reader.kinds[i]
+    alternatives = candidates.get(key)
+    if alternatives is None:
+        kind = reader.kinds[i]
+        alternatives = tuple(fn for fn, first in zip(fns, firsts) if first.could_start(kind, wid))
+        candidates[key] = alternatives
+    return alternatives
+
+#---------------------------------------------------------------------------------
+# typed AST nodes: label() builds one of these instead of a dict when it knows the fields
+# nodes behave like the dicts they replace (ast['name'], '_type' in ast, ast.items(), str(ast)),
+# listing their fields in the order the grammar sets them
+
+class AstNode:
+    __slots__ = ()
+    _type = ""
+    _fields = ()            # field names in grammar order; set on the subclasses ast_class() makes
+
+    def __getitem__(self, key: str):
+        if key == '_type': return self._type
+        if key in self._fields:
+            try: return getattr(self, key)
+            except AttributeError: pass
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, val):
+        if key == '_type' and val == self._type: return
+        if not key in self._fields: raise KeyError(key)
+        setattr(self, key, val)
+
+    def __contains__(self, key: str) -> bool:
+        return key == '_type' or (key in self._fields and hasattr(self, key))
+
+    def get(self, key: str, default=None):
+        try: return self[key]
+        except KeyError: return default
+
+    def items(self):
+        yield '_type', self._type
+        for key in self._fields:
+            val = getattr(self, key, s_missing)
+            if val is not s_missing: yield key, val
+
+    def keys(self):
+        return [key for key, val in self.items()]
+
+    def values(self):
+        return [val for key, val in self.items()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+    def update(self, other):
+        for key, val in other.items():
+            self[key] = val
+
+    def __str__(self):
+        return str(dict(self.items()))
+
+    def __repr__(self):
+        return self.__str__()
+
+s_missing = object()
+
+class AstFeature(AstNode):
+    __slots__ = ('name', 'parent', 'components')
+    _type = 'feature'
+
+class AstFunction(AstNode):
+    __slots__ = ('modifier', 'returnType', 'name', 'parameters', 'body')
+    _type = 'function'
+
+class AstStruct(AstNode):
+    __slots__ = ('modifier', 'name', 'properties')
+    _type = 'struct'
+
+class AstProperty(AstNode):
+    __slots__ = ('name', 'type', 'default')
+    _type = 'property'
+
+class AstParameter(AstNode):
+    __slots__ = ('name', 'type', 'default')
+    _type = 'parameter'
+
+class AstVariable(AstNode):
+    __slots__ = ('name', 'type', 'default')
+    _type = 'variable'
+
+s_ast_bases = { cls._type: cls for cls in [AstFeature, AstFunction, AstStruct, AstProperty, AstParameter, AstVariable] }
+s_ast_classes = {}          # (base, fields) => subclass listing fields in that order
+s_ast_nodes_enabled = True  # False: label() builds dicts, as before
+
+# the fields (fn) can set, in order, or None if we can't tell (anything but set/sequence/optional/punctuation)
+def ast_fields(fn):
+    rule = getattr(fn, 'rule', None)
+    if rule is None: return None
+    kind = rule[0]
+    if kind in ['keyword', 'indent', 'undent', 'newline']: return ()
+    if kind == 'set': return (rule[2],)
+    if kind == 'optional': return ast_fields(rule[2])
+    if kind != 'sequence': return None
+    fields = ()
+    for part in rule[2]:
+        partFields = ast_fields(part)
+        if partFields is None: return None
+        fields += tuple(field for field in partFields if not field in fields)
+    return fields
+
+# the node class for label(type, fn), or None if it has to stay a dict
+def ast_class(type: str, fn):
+    return ast_node_class(type, ast_fields(fn))
+
+# the node class for (type) with (fields) in that order, or None if it has to stay a dict
+def ast_node_class(type: str, fields):
+    base = s_ast_bases.get(type)
+    if base is None or not s_ast_nodes_enabled: return None
+    if fields is None or any(not field in base.__slots__ for field in fields): return None
+    cls = s_ast_classes.get((base, fields))
+    if cls is None:
+        cls = builtins.type(base.__name__, (base,), { '__slots__': (), '_fields': fields })
+        s_ast_classes[(base, fields)] = cls
+    return cls
+
+#---------------------------------------------------------------------------------
+# profiler: what each combinator does while parsing, attributed to where the grammar wrote it
+# profile_enable() before building a grammar: every combinator built then is wrapped to count its calls,
+# successes, failures, tokens consumed, tokens backtracked (read before failing) and time spent.
+# time includes nested combinators; self time doesn't. Profiled grammars are never compiled.
+
+s_profile_enabled = False
+s_profile = []          # ProfileStats of every combinator built while profiling
+s_profile_times = []    # time spent in nested profiled calls, one entry per profiled call in progress
+
+class ProfileStats:
+    __slots__ = ('kind', 'ctx', 'calls', 'successes', 'failures', 'consumed', 'backtracked', 'time', 'selfTime')
+    def __init__(self, kind: str, ctx):
+        self.kind = kind
+        self.ctx = ctx
+        self.reset()
+
+    def reset(self):
+        self.calls = self.successes = self.failures = self.consumed = self.backtracked = 0
+        self.time = self.selfTime = 0.0
+
+    def where(self) -> str:
+        return self.ctx.where() if isinstance(self.ctx, CallerContext) else "?"
+
+def profile_enable():
+    global s_profile_enabled
+    s_profile_enabled = True
+
+def profile_disable():
+    global s_profile_enabled
+    s_profile_enabled = False
+
+# zero the counts, keeping the profiled grammars
+def profile_reset():
+    for stats in s_profile: stats.reset()
+    s_profile_times.clear()
+
+# returns (despatch) wrapped to record its ProfileStats when parsing, or unchanged if profiling is off
+def profiled(despatch):
+    if not s_profile_enabled: return despatch
+    rule = getattr(despatch, 'rule', None)
+    stats = ProfileStats(rule[0] if rule else despatch.__name__.replace("despatch_", ""), rule[1] if rule else "")
+    s_profile.append(stats)
+    def despatch_profiled(x, ast=None):
+        if not is_reader(x): return despatch(x, ast)
+        iStart = x.i
+        s_profile_times.append(0.0)
+        start = time.perf_counter()
+        result = despatch(x)
+        elapsed = time.perf_counter() - start
+        nested = s_profile_times.pop()
+        if s_profile_times: s_profile_times[-1] += elapsed
+        stats.calls += 1
+        stats.time += elapsed
+        stats.selfTime += elapsed - nested
+        if err(result):
+            stats.failures += 1
+            stats.backtracked += max(0, result.iLex - iStart)
+        else:
+            stats.successes += 1
+            stats.consumed += x.i - iStart
+        return result
+    if rule: despatch_profiled.rule = rule
+    despatch_profiled.first = despatch.first
+    return despatch_profiled
+
+# one row per (grammar location, combinator kind) that was called, slowest self time first
+def profile_rows() -> List[dict]:
+    rows = {}
+    for stats in s_profile:
+        if stats.calls == 0: continue
+        key = (stats.where(), stats.kind)
+        row = rows.get(key)
+        if row is None:
+            row = rows[key] = { 'where': key[0], 'kind': key[1], 'calls': 0, 'successes': 0, 'failures': 0,
+                                'consumed': 0, 'backtracked': 0, 'time': 0.0, 'selfTime': 0.0 }
+        for field in ['calls', 'successes', 'failures', 'consumed', 'backtracked', 'time', 'selfTime']:
+            row[field] += getattr(stats, field)
+    return sorted(rows.values(), key=lambda row: (-row['selfTime'], row['where'], row['kind']))
+
+def profile_json() -> str:
+    return json.dumps(profile_rows(), indent=2)
+
+def profile_report() -> str:
+    lines = [f"{'where':40} {'kind':15} {'calls':>8} {'ok':>8} {'failed':>8} {'consumed':>9} {'backtracked':>11} {'ms':>9} {'self ms':>9}"]
+    for row in profile_rows():
+        lines.append(f"{row['where']:40} {row['kind']:15} {row['calls']:8} {row['successes']:8} {row['failures']:8} {row['consumed']:9} "
+                     f"{row['backtracked']:11} {row['time']*1000:9.3f} {row['selfTime']*1000:9.3f}")
+    return "\n".join(lines)
+
+# the profile goes out the same way as errors (report_error)
+def report_profile(out=None):
+    print(profile_report(), file=out or sys.stdout)
 
 #---------------------------------------------------------------------------------
 # parse and print using human-readable parser structures
 
+s_expected_indent, s_expected_undent, s_expected_newline = expected_id("{indent}"), expected_id("{undent}"), expected_id("{newline}")
+s_expected_identifier = expected_id("identifier")
+
 # keyword: match if this precise word appears next
 def keyword(word: str):
     ctx = caller_context()
+    wid = word_id(word)
+    eofMatches = word in ['{newline}', '{undent}']   # special case for premature eof
+    expected = expected_id(f"'{word}'")
+    literal = literal_lex(word)
     def parse_keyword(reader: Reader, word: str):
-        lex = reader.peek()
-        if lex == None and word in ['{newline}', '{undent}']: return {} # special case for premature eof
-        if lex and str(lex) == word:
-            reader.advance()
+        i = reader.i
+        if i >= reader.n:
+            if eofMatches: return {}
+        elif reader.ids[i] == wid:
+            reader.i = i + 1
             return {}
-        return Error(f"'{word}'", reader, ctx)
+        return reader.fail(expected, ctx)
     def print_keyword(writer: Writer, ast, word: str):
-        writer.write(Lex(SourceFile(None, word), 0, len(word)))
+        writer.write(literal)
         return True
     def despatch_keyword(x, ast=None):
         if is_reader(x): return parse_keyword(x, word)
         else: return print_keyword(x, ast, word)
-    return despatch_keyword
+    despatch_keyword.rule = ('keyword', ctx, word)
+    despatch_keyword.first = First(words=frozenset([wid]))
+    return profiled(despatch_keyword)
 
 # indent: match if the next lex is an indent
 def indent():
     ctx = caller_context()
+    literal = literal_lex('{indent}')
     def parse_indent(reader: Reader):
-        lex = reader.peek()
-        if lex and str(lex) == '{indent}':
-            reader.advance()
+        i = reader.i
+        if i < reader.n and reader.ids[i] == WORD_INDENT:
+            reader.i = i + 1
             return {}
-        return Error("{indent}", reader, ctx)
+        return reader.fail(s_expected_indent, ctx)
     def print_indent(writer: Writer, ast):
-        writer.write(Lex(SourceFile(None, '{indent}'), 0, len('{indent}')))
+        writer.write(literal)
         return True
     def despatch_indent(x, ast=None):
         if is_reader(x): return parse_indent(x)
         else: return print_indent(x, ast)
-    return despatch_indent
+    despatch_indent.rule = ('indent', ctx)
+    despatch_indent.first = First(words=frozenset([WORD_INDENT]))
+    return profiled(despatch_indent)
 
 # undent: match if the next lex is an undent
 def undent():
     ctx = caller_context()
+    literal = literal_lex('{undent}')
     def parse_undent(reader: Reader):
-        lex = reader.peek()
-        if lex and str(lex) == '{undent}':
-            reader.advance()
+        i = reader.i
+        if i < reader.n and reader.ids[i] == WORD_UNDENT:
+            reader.i = i + 1
             return {}
-        return Error("{undent}", reader, ctx)
+        return reader.fail(s_expected_undent, ctx)
     def print_undent(writer: Writer, ast):
-        writer.write(Lex(SourceFile(None, '{undent}'), 0, len('{undent}')))
+        writer.write(literal)
         return True
     def despatch_undent(x, ast=None):
         if is_reader(x): return parse_undent(x)
         else: return print_undent(x, ast)
-    return despatch_undent
+    despatch_undent.rule = ('undent', ctx)
+    despatch_undent.first = First(words=frozenset([WORD_UNDENT]))
+    return profiled(despatch_undent)
 
 # newline: match if the next lex is a newline
 def newline():
     ctx = caller_context()
+    literal = literal_lex('{newline}')
     def parse_newline(reader: Reader):
-        lex = reader.peek()
-        if lex and str(lex) == '{newline}':
-            reader.advance()
+        i = reader.i
+        if i < reader.n and reader.ids[i] == WORD_NEWLINE:
+            reader.i = i + 1
             return {}
-        return Error("{newline}", reader, ctx)
+        return reader.fail(s_expected_newline, ctx)
     def print_newline(writer: Writer, ast):
-        writer.write(Lex(SourceFile(None, '{newline}'), 0, len('{newline}')))
+        writer.write(literal)
         return True
     def despatch_newline(x, ast=None):
         if is_reader(x): return parse_newline(x)
         else: return print_newline(x, ast)
-    return despatch_newline
+    despatch_newline.rule = ('newline', ctx)
+    despatch_newline.first = First(words=frozenset([WORD_NEWLINE]))
+    return profiled(despatch_newline)
 
 # identifier: match and return if the next lex is alphanum (including '_')
 def id():
     ctx = caller_context()
     def parse_id(reader: Reader):
-        lex = reader.peek()
-        if lex and lex.is_id():
-            reader.advance()
-            return [lex]
-        return Error("identifier", reader, ctx)
+        i = reader.i
+        if i < reader.n and reader.kinds[i] == TOKEN_ID:
+            reader.i = i + 1
+            return TokenRange(reader.lexemes, i, i + 1) if reader.ranges else [reader.lexemes[i]]
+        return reader.fail(s_expected_identifier, ctx)
     def print_id(writer: Writer, ast):
         writer.write(ast[0])
         return True
     def despatch_id(x, ast=None):
         if is_reader(x): return parse_id(x)
         else: return print_id(x, ast)
-    return despatch_id
+    despatch_id.rule = ('id', ctx)
+    despatch_id.first = First(kinds=frozenset([TOKEN_ID]))
+    return profiled(despatch_id)
 
 # set: set key in AST to the result of fn
 def set(name: str, fn):
@@ -556,7 +1418,9 @@ def set(name: str, fn):
     def despatch_set(x, ast=None):
         if is_reader(x): return parse_set(x, name, fn)
         else: return print_set(x, ast, name, fn)
-    return despatch_set
+    despatch_set.rule = ('set', ctx, name, fn)
+    despatch_set.first = first_of(fn)
+    return profiled(despatch_set)
 
 # sequence: match a sequence of parsers
 def sequence(*parse_fns):
@@ -574,15 +1438,18 @@ def sequence(*parse_fns):
             if not print_fn(writer, ast): return False
         return True
     def despatch_sequence(x, ast=None):
-        if is_reader(x): return parse_sequence(x, *parse_fns)
+        if is_reader(x): return parse_memo(x, despatch_sequence, parse_sequence, *parse_fns)
         else: return print_sequence(x, ast, *parse_fns)
-    return despatch_sequence
+    despatch_sequence.rule = ('sequence', ctx, parse_fns)
+    despatch_sequence.first = first_of_sequence(parse_fns)
+    return profiled(despatch_sequence)
 
 # label: set "_type" property of the AST to (type)
 def label(type: str, fn):
     ctx = caller_context()
+    node = ast_class(type, fn)
     def parse_label(reader: Reader, type: str, parse_fn):
-        ast = { '_type' : type }
+        ast = node() if node else { '_type' : type }
         sub_ast = parse_fn(reader)
         if err(sub_ast): return sub_ast
         log("label(", type, "): ", sub_ast)
@@ -592,9 +1459,11 @@ def label(type: str, fn):
         if not ('_type' in ast or ast['_type'] != type): return False
         return print_fn(writer, ast)
     def despatch_label(x, ast=None):
-        if is_reader(x): return parse_label(x, type, fn)
+        if is_reader(x): return parse_memo(x, despatch_label, parse_label, type, fn)
         else: return print_label(x, ast, type, fn)
-    return despatch_label
+    despatch_label.rule = ('label', ctx, type, fn, node)
+    despatch_label.first = first_of(fn)
+    return profiled(despatch_label)
 
 # optional: match if the parser matches, or skip if it doesn't
 def optional(fn):
@@ -607,26 +1476,31 @@ def optional(fn):
             return ast
         return ast
     def print_optional(writer: Writer, ast, print_fn):
-        length = len(writer.lexemes)
+        mark = writer.mark()
         success = print_fn(writer, ast)
-        if not success:
-            writer.lexemes = writer.lexemes[:length]
+        if not success: writer.rollback(mark)
+        else: writer.release(mark)
         return True
     def despatch_optional(x, ast=None):
         if is_reader(x): return parse_optional(x, fn)
         else: return print_optional(x, ast, fn)
-    return despatch_optional
+    despatch_optional.rule = ('optional', ctx, fn)
+    first = first_of(fn)
+    despatch_optional.first = First(first.words, first.kinds, True, first.anything)
+    return profiled(despatch_optional)
 
 # match zero or more occurrences of (fn), terminated by (termFn)
 def list(fn, term: str):
     ctx = caller_context()
+    tid = word_id(term)
+    termLex = literal_lex(term)
     def parse_list(reader: Reader, parse_fn):
         ast = []
         while True:
-            next = reader.peek()
-            if not next: break
-            if str(next) == term:
-               reader.advance()
+            i = reader.i
+            if i >= reader.n: break
+            if reader.ids[i] == tid:
+               reader.i = i + 1
                break
             sub_ast = parse_fn(reader)
             if err(sub_ast): return sub_ast
@@ -635,98 +1509,149 @@ def list(fn, term: str):
     def print_list(writer: Writer, ast, print_fn):
         for sub_ast in ast:
             if not print_fn(writer, sub_ast): return False
+        writer.write(termLex)
         return True
     def despatch_list(x, ast=None):
         if is_reader(x): return parse_list(x, fn)
         else: return print_list(x, ast, fn)
-    return despatch_list
+    first = first_of(fn)
+    despatch_list.rule = ('list', ctx, fn, term)
+    despatch_list.first = First(first.words | frozenset([tid]), first.kinds, first.nullable, first.anything)
+    return profiled(despatch_list)
 
 # match zero or more occurrences of (fn) separated by (sep) [internally only]
 def list_separated(fn, sep: str, term: str):
     ctx = caller_context()
+    sid = word_id(sep)
+    tid = word_id(term)
+    sepLex = literal_lex(sep)
+    termLex = literal_lex(term)
+    terminates = term == '{undent}'     # in a block, (sep) ends every item; in brackets, it only goes between them
     def parse_list_separated(reader: Reader, parse_fn, sep):
         ast = []
+        ids = reader.ids
         while True:
-            if str(reader.peek()) == term:
+            if reader.i < reader.n and ids[reader.i] == tid:
                 reader.advance()
                 break
             sub_ast = parse_fn(reader)
             if err(sub_ast): return sub_ast
             ast.append(sub_ast)
-            next = reader.peek()
-            if str(next) == term:
-                reader.advance()
-                break
-            elif str(next) == sep:
-                reader.advance()
+            if reader.i < reader.n:
+                if ids[reader.i] == tid:
+                    reader.advance()
+                    break
+                elif ids[reader.i] == sid:
+                    reader.advance()
         return ast
     def print_list_separated(writer: Writer, ast, print_fn, sep: str):
-        for sub_ast in ast:
+        for i, sub_ast in enumerate(ast):
+            if i > 0 and not terminates: writer.write(sepLex)
             if not print_fn(writer, sub_ast): return False
-            writer.write(Lex(SourceFile(None, sep), 0, len(sep)))
+            if terminates: writer.write(sepLex)
+        writer.write(termLex)
         return True
     def despatch_list_separated(x, ast=None):
         if is_reader(x): return parse_list_separated(x, fn, sep)
         else: return print_list_separated(x, ast, fn, sep)
-    return despatch_list_separated
+    first = first_of(fn)
+    despatch_list_separated.rule = ('list_separated', ctx, fn, sep, term)
+    despatch_list_separated.first = First(first.words | frozenset([tid]), first.kinds, first.nullable, first.anything)
+    return profiled(despatch_list_separated)
 
 # match any of the given fns
+# the next token's FIRST-set entry says which alternatives could match: only those are tried, in order;
+# if none of them match, all alternatives are tried so the error is the same as before
 def anyof(*fns):
     ctx = caller_context()
+    firsts = [first_of(fn) for fn in fns]
+    candidates = {}
     def parse_anyof(reader: Reader, *parse_fns):
-        errors = []
-        for parse_fn in parse_fns:
-            iLex = reader.i
+        iLex = reader.i
+        failed = {}                 # alternative => its error; each alternative is tried at most once
+        for parse_fn in first_candidates(reader, fns, firsts, candidates):
             ast = parse_fn(reader)
             if not err(ast): return ast
-            errors.append(ast)
+            failed[parse_fn] = ast.copy()
             reader.i = iLex
-        error = combine_errors(errors)
-        print("anyof error:", error)
-        return error
+        errors = []
+        for parse_fn in parse_fns:
+            ast = failed.get(parse_fn)
+            if ast is None:
+                ast = parse_fn(reader)
+                if not err(ast): return ast
+                ast = ast.copy()
+                reader.i = iLex
+            errors.append(ast)
+        return combine_errors(errors)
     def print_anyof(writer: Writer, ast, *print_fns):
         for print_fn in print_fns:
-            iLex = len(writer.lexemes)
-            if print_fn(writer, ast): return True
-            writer.lexemes = writer.lexemes[:iLex]
+            mark = writer.mark()
+            if print_fn(writer, ast):
+                writer.release(mark)
+                return True
+            writer.rollback(mark)
         return False
     def despatch_anyof(x, ast=None):
-        if is_reader(x): return parse_anyof(x, *fns)
+        if is_reader(x): return parse_memo(x, despatch_anyof, parse_anyof, *fns)
         else: return print_anyof(x, ast, *fns)
-    return despatch_anyof
+    despatch_anyof.rule = ('anyof', ctx, fns)
+    despatch_anyof.first = first_of_alternatives(fns)
+    return profiled(despatch_anyof)
 
 # match any of the given words (like keyword), return it
 def enum(*words):
     ctx = caller_context()
+    wids = frozenset(word_id(word) for word in words)
+    expected = expected_id(f"{words}")
     def parse_enum(reader: Reader, *words):
-        lex = reader.peek()
-        if lex and str(lex) in words:
-            reader.advance()
-            return [lex]
-        return Error(f"{words}", reader, ctx)
+        i = reader.i
+        if i < reader.n and reader.ids[i] in wids:
+            reader.i = i + 1
+            return TokenRange(reader.lexemes, i, i + 1) if reader.ranges else [reader.lexemes[i]]
+        return reader.fail(expected, ctx)
     def print_enum(writer: Writer, ast, *words):
         writer.write(ast[0])
         return True
     def despatch_enum(x, ast=None):
         if is_reader(x): return parse_enum(x, *words)
         else: return print_enum(x, ast, *words)
-    return despatch_enum
+    despatch_enum.rule = ('enum', ctx, words)
+    despatch_enum.first = First(words=wids)
+    return profiled(despatch_enum)
+
+# where upto(wids) starting at (i) stops: the first of (wids) not inside brackets, or n
+# uses the bracket table to skip whole bracketed runs; if (wids) are all closers and (i) is just inside
+# an opener, that opener's closer is the answer, so bodies cost O(1) whatever their size
+def upto_end(ids, matches, n: int, i: int, wids) -> int:
+    if i > 0 and ids[i-1] in s_open_ids and wids <= s_close_ids:
+        iClose = matches[i-1]
+        if iClose < n and ids[iClose] in wids: return iClose
+    while i < n:
+        wid = ids[i]
+        if wid in wids: return i
+        if wid in s_open_ids: i = matches[i] + 1
+        elif wid in s_close_ids: break
+        else: i += 1
+    # an unmatched closer: count depth from here on, as it goes negative
+    depth = 0
+    while i < n:
+        wid = ids[i]
+        if depth == 0 and wid in wids: break
+        if wid in s_open_ids: depth += 1
+        elif wid in s_close_ids: depth -= 1
+        i += 1
+    return min(i, n)
 
 # match up one of (words), but only if not inside braces/brackets/parens
 def upto(words : List[str]):
     ctx = caller_context()
+    wids = frozenset(word_id(word) for word in words)
     def parse_upto(reader: Reader, words):
-        depth = 0
-        out = []
-        while True:
-            lex = reader.peek()
-            if not lex: return out
-            if depth ==0 and str(lex) in words: 
-                return out
-            out.append(lex)
-            if str(lex) in ["(", "[", "{indent}"]: depth += 1
-            elif str(lex) in [")", "]", "{undent}"]: depth -= 1
-            reader.advance()
+        iStart = reader.i
+        i = reader.i = upto_end(reader.ids, reader.matches, reader.n, iStart, wids)
+        if reader.ranges: return TokenRange(reader.lexemes, iStart, i)
+        return [reader.lexemes[j] for j in range(iStart, i)]
     def print_upto(writer: Writer, ast, words):
         for lex in ast:
             writer.write(lex)
@@ -734,7 +1659,9 @@ def upto(words : List[str]):
     def despatch_upto(x, ast=None):
         if is_reader(x): return parse_upto(x, words)
         else: return print_upto(x, ast, words)
-    return despatch_upto
+    despatch_upto.rule = ('upto', ctx, words)
+    despatch_upto.first = s_first_anything
+    return profiled(despatch_upto)
 
 # debug: turns on logging for the sub-parser
 def debug(fn):
@@ -751,9 +1678,439 @@ def debug(fn):
     def despatch_debug(x, ast=None):
         if is_reader(x): return parse_debug(x, fn)
         else: return print_debug(x, ast, fn)
-    return despatch_debug
+    despatch_debug.first = first_of(fn)
+    return profiled(despatch_debug)
 
 
+#---------------------------------------------------------------------------------
+# grammar compiler: turns a combinator grammar into one python module of straight-line parse functions
+# every combinator leaves its rule on (parser.rule); the compiler walks those and writes code that
+# does the same work without the despatch / is_reader / closure calls. Terminals, set() and nested
+# sequences are inlined into the enclosing function; anything without a rule (debug, hand-written fns)
+# is called through unchanged. The module is cached on disk, named by the hash of its source;
+# if the cache folder can't be written, the source is run in memory instead.
+# Compiled parsers don't log, and hand packrat readers to the interpreted grammar.
+
+s_compiler_version = 7
+s_cache_folder = os.path.join(os.path.expanduser("~"), ".cache", "fnf")
+
+class GrammarCompiler:
+    def __init__(self):
+        self.nodes = []             # parser fns, in the order we named them
+        self.names = {}             # python id of parser fn => name of its compiled function
+        self.constants = {}         # constant expression => name
+        self.functions = []         # lines of each compiled function
+        self.tables = []            # lines run after all functions are defined
+        self.nLocals = 0
+
+    def compile(self, parser) -> str:
+        root = self.function(parser)
+        lines = [f"# fnf compiled grammar (compiler version {s_compiler_version}): generated by GrammarCompiler, do not edit",
+                 "def bind(nodes, root, word_id, Error, combine_errors, first_of, first_candidates, upto_end, expected_id, TokenRange, TOKEN_ID):"]
+        lines += [f"    {name} = {expression}" for expression, name in self.constants.items()]
+        for function in self.functions: lines += [""] + function
+        lines += [""] + self.tables
+        lines += ["    def parse(reader):",
+                  "        if reader.memo is not None: return root(reader)",
+                  f"        return {root}(reader)",
+                  "    return parse", ""]
+        return "\n".join(lines)
+
+    def constant(self, expression: str) -> str:
+        if not expression in self.constants:
+            self.constants[expression] = f"K{len(self.constants)}"
+        return self.constants[expression]
+
+    def word(self, word: str) -> str:
+        return self.constant(f"word_id({repr(word)})")
+
+    def words(self, words) -> str:
+        return self.constant(f"frozenset([word_id(word) for word in {repr(tuple(words))}])")
+
+    def expected(self, expected: str) -> str:
+        return self.constant(f"expected_id({repr(expected)})")
+
+    def ctx(self, fn) -> str:
+        return self.constant(f"nodes[{self.node(fn)}].rule[1]")
+
+    def node(self, fn) -> int:
+        for i, node in enumerate(self.nodes):
+            if node is fn: return i
+        self.nodes.append(fn)
+        return len(self.nodes) - 1
+
+    def local(self, prefix: str) -> str:
+        self.nLocals += 1
+        return f"{prefix}{self.nLocals}"
+
+    # name of the compiled function for (fn), compiling it the first time
+    def function(self, fn) -> str:
+        key = builtins.id(fn)
+        if key in self.names: return self.names[key]
+        rule = getattr(fn, 'rule', None)
+        if rule is None: return self.constant(f"nodes[{self.node(fn)}]")
+        name = f"p{len(self.names)}_{rule[0]}"
+        self.names[key] = name
+        body = [f"    def {name}(reader):",
+                "        lexemes, ids, kinds, n, i, ranges = reader.lexemes, reader.ids, reader.kinds, reader.n, reader.i, reader.ranges"]
+        kind = rule[0]
+        if kind == 'sequence':
+            body += ["        ast = {}"] + self.sequence(rule[2], 2) + ["        reader.i = i", "        return ast"]
+        elif kind == 'label':
+            node = rule[4] is not None
+            new = f"{self.constant(f"nodes[{self.node(fn)}].rule[4]")}()" if node else f"{{'_type': {repr(rule[2])}}}"
+            body += [f"        ast = {new}"]
+            if getattr(rule[3], 'rule', ('',))[0] == 'sequence':
+                body += self.sequence(rule[3].rule[2], 2, node) + ["        reader.i = i", "        return ast"]
+            else:
+                body += self.call(rule[3], "v", 2) + ["        ast.update(v)", "        return ast"]
+        elif kind == 'set':
+            body += self.value(rule[3], 2) + ["        reader.i = i", f"        return {{{repr(rule[2])}: v}}"]
+        elif kind == 'optional':
+            body += self.call(rule[2], "v", 2, reset=False)[:-1] + [
+                    "        if isinstance(v, Error):",
+                    "            if v.iLex == i: return {}",
+                    "            return v",
+                    "        return v"]
+        elif kind == 'anyof':
+            alternatives, firsts, candidates = self.local("alternatives"), self.local("firsts"), self.local("candidates")
+            self.tables += [f"    {alternatives} = ({", ".join(self.function(alt) for alt in rule[2])},)",
+                            f"    {firsts} = [first_of(fn) for fn in nodes[{self.node(fn)}].rule[2]]",
+                            f"    {candidates} = {{}}"]
+            body += ["        failed = {}",
+                     f"        for fn in first_candidates(reader, {alternatives}, {firsts}, {candidates}):",
+                     "            v = fn(reader)",
+                     "            if not isinstance(v, Error): return v",
+                     "            failed[fn] = v.copy()",
+                     "            reader.i = i",
+                     "        errors = []",
+                     f"        for fn in {alternatives}:",
+                     "            v = failed.get(fn)",
+                     "            if v is None:",
+                     "                v = fn(reader)",
+                     "                if not isinstance(v, Error): return v",
+                     "                v = v.copy()",
+                     "                reader.i = i",
+                     "            errors.append(v)",
+                     "        return combine_errors(errors)"]
+        else:
+            body += self.value(fn, 2) + ["        reader.i = i", "        return v"]
+        self.functions.append(body)
+        return name
+
+    # code that calls (fn) at i, leaving its result in (var); errors return unless (reset) is False
+    def call(self, fn, var: str, depth: int, reset: bool=True) -> List[str]:
+        pad = "    " * depth
+        lines = [f"{pad}reader.i = i", f"{pad}{var} = {self.function(fn)}(reader)"]
+        if reset: lines += [f"{pad}if isinstance({var}, Error): return {var}"]
+        return lines + [f"{pad}i = reader.i"]
+
+    # code that reads a word at i, or returns (error)
+    def match_word(self, word: str, ctx: str, expected: str, depth: int) -> List[str]:
+        pad = "    " * depth
+        return [f"{pad}if i < n and ids[i] == {self.word(word)}: i += 1",
+                f"{pad}else:",
+                f"{pad}    reader.i = i",
+                f"{pad}    return reader.fail({self.expected(expected)}, {ctx})"]
+
+    # code that parses (fn) at i and leaves its result in v
+    def value(self, fn, depth: int) -> List[str]:
+        pad = "    " * depth
+        rule = getattr(fn, 'rule', None)
+        kind = rule[0] if rule else None
+        if kind == 'keyword':
+            word = rule[2]
+            ctx = self.ctx(fn)
+            if not word in ['{newline}', '{undent}']:
+                return self.match_word(word, ctx, f"'{word}'", depth) + [f"{pad}v = {{}}"]
+            return [f"{pad}if i < n:",
+                    f"{pad}    if ids[i] == {self.word(word)}: i += 1",
+                    f"{pad}    else:",
+                    f"{pad}        reader.i = i",
+                    f"{pad}        return reader.fail({self.expected(f"'{word}'")}, {ctx})",
+                    f"{pad}v = {{}}"]
+        if kind in ['indent', 'undent', 'newline']:
+            word = f"{{{kind}}}"
+            return self.match_word(word, self.ctx(fn), word, depth) + [f"{pad}v = {{}}"]
+        if kind == 'id':
+            return [f"{pad}if i < n and kinds[i] == TOKEN_ID:",
+                    f"{pad}    v = TokenRange(lexemes, i, i + 1) if ranges else [lexemes[i]]",
+                    f"{pad}    i += 1",
+                    f"{pad}else:",
+                    f"{pad}    reader.i = i",
+                    f"{pad}    return reader.fail({self.expected("identifier")}, {self.ctx(fn)})"]
+        if kind == 'enum':
+            return [f"{pad}if i < n and ids[i] in {self.words(rule[2])}:",
+                    f"{pad}    v = TokenRange(lexemes, i, i + 1) if ranges else [lexemes[i]]",
+                    f"{pad}    i += 1",
+                    f"{pad}else:",
+                    f"{pad}    reader.i = i",
+                    f"{pad}    return reader.fail({self.expected(f"{rule[2]}")}, {self.ctx(fn)})"]
+        if kind == 'upto':
+            start = self.local("start")
+            return [f"{pad}{start}, i = i, upto_end(ids, reader.matches, n, i, {self.words(rule[2])})",
+                    f"{pad}v = TokenRange(lexemes, {start}, i) if ranges else [lexemes[j] for j in range({start}, i)]"]
+        if kind == 'list':
+            out = self.local("out")
+            return [f"{pad}{out} = []",
+                    f"{pad}while i < n:",
+                    f"{pad}    if ids[i] == {self.word(rule[3])}:",
+                    f"{pad}        i += 1",
+                    f"{pad}        break"] + self.call(rule[2], "v", depth+1) + [
+                    f"{pad}    {out}.append(v)",
+                    f"{pad}v = {out}"]
+        if kind == 'list_separated':
+            out, term, sep = self.local("out"), self.word(rule[4]), self.word(rule[3])
+            return [f"{pad}{out} = []",
+                    f"{pad}while True:",
+                    f"{pad}    if i < n and ids[i] == {term}:",
+                    f"{pad}        i += 1",
+                    f"{pad}        break"] + self.call(rule[2], "v", depth+1) + [
+                    f"{pad}    {out}.append(v)",
+                    f"{pad}    if i < n:",
+                    f"{pad}        if ids[i] == {term}:",
+                    f"{pad}            i += 1",
+                    f"{pad}            break",
+                    f"{pad}        elif ids[i] == {sep}: i += 1",
+                    f"{pad}v = {out}"]
+        return self.call(fn, "v", depth)
+
+    # code that parses each of (fns) in turn, merging results into ast (an AstNode if (node))
+    def sequence(self, fns, depth: int, node: bool=False) -> List[str]:
+        pad = "    " * depth
+        lines = []
+        for fn in fns:
+            rule = getattr(fn, 'rule', None)
+            kind = rule[0] if rule else None
+            if kind in ['keyword', 'indent', 'undent', 'newline']:
+                lines += self.value(fn, depth)[:-1]
+            elif kind == 'set':
+                lines += self.value(rule[3], depth) + [f"{pad}ast.{rule[2]} = v" if node else f"{pad}ast[{repr(rule[2])}] = v"]
+            elif kind == 'sequence':
+                lines += self.sequence(rule[2], depth, node)
+            elif kind == 'optional' and self.starts_with_word(rule[2]):
+                # fails at its first token, or after it: so we can test that token and inline the rest
+                # (noting the expected token for the farthest-failure tracker, as the keyword would)
+                first, rest = rule[2].rule[2][0], rule[2].rule[2][1:]
+                word = first.rule[2] if first.rule[0] == 'keyword' else f"{{{first.rule[0]}}}"
+                expected = f"'{word}'" if first.rule[0] == 'keyword' else word
+                eid, ctx = self.expected(expected), self.ctx(first)
+                lines += [f"{pad}if i < n and ids[i] == {self.word(word)}:",
+                          f"{pad}    i += 1"] + self.sequence(rest, depth+1, node) + [
+                          f"{pad}elif i > reader.farthest:",
+                          f"{pad}    reader.farthest = i",
+                          f"{pad}    reader.expecting = {{{eid}: {ctx}}}",
+                          f"{pad}elif i == reader.farthest and not {eid} in reader.expecting: reader.expecting[{eid}] = {ctx}"]
+            elif kind == 'optional':
+                lines += self.call(rule[2], "v", depth, reset=False)[:-1] + [
+                          f"{pad}if isinstance(v, Error):",
+                          f"{pad}    if v.iLex != i: return v",
+                          f"{pad}    v = {{}}",
+                          f"{pad}i = reader.i",
+                          f"{pad}ast.update(v)"]
+            else:
+                lines += self.call(fn, "v", depth) + [f"{pad}ast.update(v)"]
+        return lines
+
+    # true if (fn) is a sequence whose first part is a keyword/indent/undent/newline that can't match eof
+    def starts_with_word(self, fn) -> bool:
+        rule = getattr(fn, 'rule', None)
+        if rule is None or rule[0] != 'sequence' or len(rule[2]) == 0: return False
+        first = getattr(rule[2][0], 'rule', None)
+        if first is None: return False
+        if first[0] == 'keyword': return not first[2] in ['{newline}', '{undent}']
+        return first[0] in ['indent', 'undent', 'newline']
+
+# compile (parser) to python, cache the module on disk, and return its parse function
+def compile_grammar(parser):
+    compiler = GrammarCompiler()
+    source = compiler.compile(parser)
+    digest = hashlib.sha1(source.encode()).hexdigest()[:16]
+    path = os.path.join(s_cache_folder, f"grammar_{digest}.py")
+    try:
+        if not os.path.exists(path): writeFileAtomically(path, source)
+        spec = importlib.util.spec_from_file_location(f"fnf_grammar_{digest}", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        bind = module.bind
+    except OSError:
+        namespace = { '__name__': f"fnf_grammar_{digest}" }
+        exec(compile(source, f"<grammar_{digest}>", "exec"), namespace)
+        bind = namespace['bind']
+    return bind(compiler.nodes, parser, word_id, Error, combine_errors, first_of, first_candidates, upto_end, expected_id, TokenRange, TOKEN_ID)
+
+#---------------------------------------------------------------------------------
+# iterative engine: parses with the same grammar objects, keeping its own stack instead of Python's
+# it reads each combinator's (parser.rule), as the compiler does, and keeps one Frame per combinator in progress,
+# so grammar depth costs list entries rather than Python frames, and can't raise RecursionError.
+# Terminals (keyword, id, enum, upto...) and anything without a rule are called as they are.
+# Results, errors, FIRST dispatch and packrat memo are as the recursive engine's; it doesn't log.
+
+s_iterative_terminals = frozenset(['keyword', 'indent', 'undent', 'newline', 'id', 'enum', 'upto'])
+s_iterative_memoised = frozenset(['sequence', 'label', 'anyof'])
+
+# a combinator in progress: what it has built so far, and which child it's up to
+class Frame:
+    __slots__ = ('kind', 'parser', 'rule', 'iStart', 'ast', 'index', 'alternatives', 'errors', 'result')
+    def __init__(self, kind: str, parser, rule, iStart: int):
+        self.kind = kind
+        self.parser = parser
+        self.rule = rule
+        self.iStart = iStart
+        self.ast = None
+        self.index = 0
+        self.alternatives = None    # anyof: the alternatives being tried
+        self.errors = None          # anyof: alternative => its error; FIRST candidates are tried first, then the rest
+        self.result = None
+
+class IterativeParser:
+    def __init__(self, parser):
+        self.parser = parser
+        self.words = {}             # list/list_separated parser => (term word id, separator word id)
+        self.firsts = {}            # anyof parser => (FIRST of each alternative, candidates cache)
+
+    def __call__(self, reader: Reader):
+        memo = reader.memo
+        stack = []
+        fn = self.parser
+        while True:
+            # start (fn): it finishes at once with (result), or pushes a frame and names its first child
+            rule = getattr(fn, 'rule', None)
+            kind = rule[0] if rule else None
+            hit = memo.get((fn, reader.i)) if memo is not None and kind in s_iterative_memoised else None
+            if kind is None or kind in s_iterative_terminals:
+                result, fn = fn(reader), None
+            elif hit:
+                reader.memoHits += 1
+                reader.memoSkipped += hit[1] - reader.i
+                reader.i = hit[1]
+                result, fn = hit[0], None
+            else:
+                if memo is not None and kind in s_iterative_memoised: reader.memoMisses += 1
+                frame = Frame(kind, fn, rule, reader.i)
+                fn = self.start(frame, reader)
+                if fn is not None:
+                    stack.append(frame)
+                    continue
+                result = self.finish(frame, reader)
+            # hand (result) to the frame on top, until one of them starts another child
+            while fn is None:
+                if not stack: return result
+                frame = stack[-1]
+                fn = self.resume(frame, result, reader)
+                if fn is None:
+                    stack.pop()
+                    result = self.finish(frame, reader)
+
+    # first child of a new frame, or None if it's already finished
+    def start(self, frame: Frame, reader: Reader):
+        kind, rule = frame.kind, frame.rule
+        if kind == 'sequence':
+            frame.ast = {}
+            if len(rule[2]) == 0:
+                frame.result = frame.ast
+                return None
+            return rule[2][0]
+        if kind == 'set': return rule[3]
+        if kind == 'optional': return rule[2]
+        if kind == 'label':
+            node = rule[4]
+            frame.ast = node() if node else { '_type' : rule[2] }
+            return rule[3]
+        if kind == 'list' or kind == 'list_separated':
+            frame.ast = []
+            return self.next_item(frame, reader)
+        if kind == 'anyof':
+            firsts, candidates = self.alternative_firsts(frame.parser, rule)
+            frame.alternatives = first_candidates(reader, rule[2], firsts, candidates) or rule[2]
+            frame.errors = {}
+            return frame.alternatives[0]
+        raise ValueError(f"IterativeParser: can't interpret '{kind}'")
+
+    # (frame)'s child returned (result): the next child, or None once (frame.result) is set
+    def resume(self, frame: Frame, result, reader: Reader):
+        kind, rule = frame.kind, frame.rule
+        failed = err(result)
+        if kind == 'anyof':
+            if not failed:
+                frame.result = result
+                return None
+            frame.errors[frame.alternatives[frame.index]] = result.copy()
+            reader.i = frame.iStart
+            frame.index += 1
+            if frame.index < len(frame.alternatives): return frame.alternatives[frame.index]
+            rest = tuple(fn for fn in rule[2] if fn not in frame.errors)
+            if rest:
+                frame.alternatives, frame.index = rest, 0
+                return rest[0]
+            frame.result = combine_errors([frame.errors[fn] for fn in rule[2]])
+            return None
+        if kind == 'optional':
+            frame.result = {} if failed and result.iLex == frame.iStart else result
+            return None
+        if failed:
+            frame.result = result
+            return None
+        if kind == 'sequence':
+            frame.ast.update(result)
+            frame.index += 1
+            if frame.index < len(rule[2]): return rule[2][frame.index]
+            frame.result = frame.ast
+        elif kind == 'set':
+            frame.result = { rule[2] : result }
+        elif kind == 'label':
+            frame.ast.update(result)
+            frame.result = frame.ast
+        elif kind == 'list':
+            frame.ast.append(result)
+            return self.next_item(frame, reader)
+        elif kind == 'list_separated':
+            frame.ast.append(result)
+            tid, sid = self.term_words(frame.parser, rule)
+            i = reader.i
+            if i < reader.n:
+                if reader.ids[i] == tid:
+                    reader.i = i + 1
+                    frame.result = frame.ast
+                    return None
+                elif reader.ids[i] == sid:
+                    reader.i = i + 1
+            return self.next_item(frame, reader)
+        return None
+
+    # list/list_separated: finish at the terminator (or eof, for list), otherwise parse another item
+    def next_item(self, frame: Frame, reader: Reader):
+        tid, sid = self.term_words(frame.parser, frame.rule)
+        i = reader.i
+        if i >= reader.n and frame.kind == 'list':
+            frame.result = frame.ast
+            return None
+        if i < reader.n and reader.ids[i] == tid:
+            reader.i = i + 1
+            frame.result = frame.ast
+            return None
+        return frame.rule[2]
+
+    # (frame) has finished: remember its result if packrat, and pass it on
+    def finish(self, frame: Frame, reader: Reader):
+        result = frame.result
+        if reader.memo is not None and frame.kind in s_iterative_memoised:
+            if result is reader.failure: result = result.copy()
+            reader.memo[(frame.parser, frame.iStart)] = (result, reader.i)
+        return result
+
+    def term_words(self, fn, rule):
+        words = self.words.get(fn)
+        if words is None:
+            words = self.words[fn] = (word_id(rule[-1]), word_id(rule[3]) if rule[0] == 'list_separated' else 0)
+        return words
+
+    def alternative_firsts(self, fn, rule):
+        firsts = self.firsts.get(fn)
+        if firsts is None:
+            firsts = self.firsts[fn] = ([first_of(alternative) for alternative in rule[2]], {})
+        return firsts
+
 #---------------------------------------------------------------------------------
 # Language base class and common parser structures
 
@@ -775,6 +2132,67 @@ def feature(lang : Language):
             indent(),
             set("components", list(component(lang), "{undent}"))))
 
+# building a grammar is expensive (every combinator calls caller_context), so each Language's is built once
+# and shared by all Features and Contexts; the parsers are pure closures, so sharing them is safe
+s_grammars = {}     # (Language subclass, profiled?) => feature parser
+
+def grammar(lang: Language):
+    key = (type(lang), s_profile_enabled)
+    parser = s_grammars.get(key)
+    if parser is None:
+        parser = feature(lang)
+        s_grammars[key] = parser
+    return parser
+
+# the compiled form of grammar(lang); Feature.parse uses it unless s_compiled_enabled is False,
+# which leaves the interpreted combinators (and their logging) for debugging
+s_compiled_enabled = True
+s_compiled_grammars = {}    # Language subclass => compiled feature parser
+
+def compiled_grammar(lang: Language):
+    parser = s_compiled_grammars.get(type(lang))
+    if parser is None:
+        parser = compile_grammar(grammar(lang))
+        s_compiled_grammars[type(lang)] = parser
+    return parser
+
+# a digest of grammar(lang) that changes whenever the grammar does, read from its rules without compiling it
+s_grammar_digests = {}      # Language subclass => digest
+
+def grammar_digest(lang: Language) -> str:
+    digest = s_grammar_digests.get(type(lang))
+    if digest is None:
+        digest = s_grammar_digests[type(lang)] = rules_digest(grammar(lang))
+    return digest
+
+# hash of each combinator's kind, words and field names, in order; a combinator seen before hashes as its number
+def rules_digest(parser) -> str:
+    digest = hashlib.sha1()
+    numbers = {}                # builtins.id(combinator) => order first seen
+    stack = [parser]
+    while stack:
+        fn = stack.pop()
+        number = numbers.get(builtins.id(fn))
+        if number is not None:
+            digest.update(f"#{number};".encode())
+            continue
+        numbers[builtins.id(fn)] = len(numbers)
+        rule = getattr(fn, 'rule', None)
+        if rule is None:
+            digest.update(f"{getattr(fn, '__qualname__', '?')};".encode())
+            continue
+        children = []
+        parts = [rule[0]]
+        for part in rule[2:]:
+            if isinstance(part, builtins.type) or part is None: continue      # label's node class follows from its fields
+            if isinstance(part, str): parts.append(repr(part))
+            elif callable(part): children.append(part)
+            elif all(isinstance(item, str) for item in part): parts.append(repr(builtins.list(part)))
+            else: children += part
+        digest.update(f"{' '.join(parts)} {len(children)};".encode())
+        stack += reversed(children)
+    return digest.hexdigest()[:16]
+
 def component(lang : Language):
     return anyof(function(lang), struct(lang), variable(lang))
 
@@ -855,7 +2273,7 @@ ast_ts = """
 """
 
 print_ts = """
-[feature, Hello, extends, Feature, {indent}, on, hello, (, name, :, string, ,, :, number, {indent}, output, (, `Hello, ${name}!`, ), ;, return, 0, ;, {undent}, on, output, (, message, :, string, ,, indent, :, number, =, 0, ,, {indent}, console, ., log, (, "    ", ., repeat, (, indent, ), +, message, ), ;, {undent}, replace, main, (, :, number, {indent}, return, hello, (, "world", ), ;, {undent}, struct, Colour, {indent}, red, :, number, =, 0, ;, green, :, number, =, 0, ;, blue, :, number, =, 0, ;, local, colour, :, Colour, =, new, Colour, (, 1, ,, 1, ,, 1, ), ;]
+[feature, Hello, extends, Feature, {indent}, on, hello, (, name, :, string, ), :, number, {indent}, output, (, `Hello, ${name}!`, ), ;, return, 0, ;, {undent}, on, output, (, message, :, string, ,, indent, :, number, =, 0, ), {indent}, console, ., log, (, "    ", ., repeat, (, indent, ), +, message, ), ;, {undent}, replace, main, (, ), :, number, {indent}, return, hello, (, "world", ), ;, {undent}, struct, Colour, {indent}, red, :, number, =, 0, ;, green, :, number, =, 0, ;, blue, :, number, =, 0, ;, {undent}, local, colour, :, Colour, =, new, Colour, (, 1, ,, 1, ,, 1, ), ;, {undent}]
 """
 
 #---------------------------------------------------------------------------------
@@ -869,8 +2287,8 @@ class Python(Language):
         return sequence(
             set('name', id()),
             keyword("("),
-            set("parameters", list_separated(self.parameter(), ",", keyword(")")),
-            optional(sequence(keyword("->"), set("returnType", id()))))
+            set("parameters", list_separated(self.parameter(), ",", ")")),
+            optional(sequence(keyword("->"), set("returnType", id())))
         )
     def parameter(self):
         return sequence(
@@ -896,7 +2314,7 @@ lexemes_py = """
 [feature, Hello, extends, Feature, {indent}, on, hello, (, name, :, string, ), ->, int, {indent}, print, (, f, "Hello, {name}!", ), {newline}, return, 0, {undent}, replace, main, (, ), ->, int, {indent}, return, hello, (, "world", ), {undent}, struct, Colour, {indent}, red, :, int, =, 0, {newline}, green, :, int, =, 0, {newline}, blue, :, int, =, 0, {undent}, local, colour, :, Colour, =, Colour, (, 1, ,, 1, ,, 1, )]
 """
 ast_py = """
-{'_type': 'feature', 'name': [Hello], 'parent': [Feature], 'components': [{'_type': 'function', 'modifier': [on], 'name': [hello], 'parameters': [{'name': [name], 'type': [string]}], 'returnType': [int], 'body': [print, (, f, "Hello, {name}!", ), {newline}, return, 0]}, {'_type': 'function', 'modifier': [replace], 'name': [main], 'parameters': [], 'returnType': [int], 'body': [return, hello, (, "world", )]}, {'_type': 'struct', 'modifier': [struct], 'name': [Colour], 'properties': [{'name': [red], 'type': [int], 'default': [0]}, {'name': [green], 'type': [int], 'default': [0]}, {'name': [blue], 'type': [int], 'default': [0]}]}, {'_type': 'variable', 'name': [colour], 'type': [Colour], 'default': [Colour, (, 1, ,, 1, ,, 1, )]}]}
+{'_type': 'feature', 'name': [Hello], 'parent': [Feature], 'components': [{'_type': 'function', 'modifier': [on], 'name': [hello], 'parameters': [{'name': [name], 'type': [string]}], 'returnType': [int], 'body': [print, (, f, "Hello, {name}!", ), {newline}, return, 0]}, {'_type': 'function', 'modifier': [replace], 'name': [main], 'parameters': [], 'returnType': [int], 'body': [return, hello, (, "world", )]}, {'_type': 'struct', 'modifier': [struct], 'name': [Colour], 'properties': [{'_type': 'property', 'name': [red], 'type': [int], 'default': [0]}, {'_type': 'property', 'name': [green], 'type': [int], 'default': [0]}, {'_type': 'property', 'name': [blue], 'type': [int], 'default': [0]}]}, {'_type': 'variable', 'name': [colour], 'type': [Colour], 'default': [Colour, (, 1, ,, 1, ,, 1, )]}]}
 """
 print_py = """
 [feature, Hello, extends, Feature, {indent}, on, hello, (, name, :, string, ), ->, int, {indent}, print, (, f, "Hello, {name}!", ), {newline}, return, 0, {undent}, replace, main, (, ), ->, int, {indent}, return, hello, (, "world", ), {undent}, struct, Colour, {indent}, red, :, int, =, 0, {newline}, green, :, int, =, 0, {newline}, blue, :, int, =, 0, {newline}, {undent}, local, colour, :, Colour, =, Colour, (, 1, ,, 1, ,, 1, ), {newline}, {undent}]
@@ -913,8 +2331,7 @@ class C(Language):
             set('returnType', id()),
             set('name', id()),
             keyword("("),
-            set("parameters", list(self.parameter())),
-            keyword(")")
+            set("parameters", list_separated(self.parameter(), ",", ")"))
         )
     def parameter(self):
         return sequence(
@@ -946,7 +2363,7 @@ lexemes_c = """
 """
 
 ast_c = """
-{'_type': 'feature', 'name': [Hello], 'parent': [Feature], 'components': [{'_type': 'function', 'modifier': [on], 'returnType': [int], 'name': [hello], 'parameters': [{'type': [string], 'name': [name]}], 'body': [printf, (, "Hello, %s!", ,, name, ), ;, return, 0, ;]}, {'_type': 'function', 'modifier': [replace], 'returnType': [int], 'name': [main], 'parameters': [], 'body': [return, hello, (, "world", ), ;]}, {'_type': 'struct', 'modifier': [struct], 'name': [Colour], 'properties': [{'type': [int], 'name': [red], 'default': [0]}, {'type': [int], 'name': [green], 'default': [0]}, {'type': [int], 'name': [blue], 'default': [0]}]}, {'_type': 'variable', 'type': [Colour], 'name': [colour], 'default': [Colour, (, 1, ,, 1, ,, 1, )]}]}
+{'_type': 'feature', 'name': [Hello], 'parent': [Feature], 'components': [{'_type': 'function', 'modifier': [on], 'returnType': [int], 'name': [hello], 'parameters': [{'type': [string], 'name': [name]}], 'body': [printf, (, "Hello, %s!", ,, name, ), ;, return, 0, ;]}, {'_type': 'function', 'modifier': [replace], 'returnType': [int], 'name': [main], 'parameters': [], 'body': [return, hello, (, "world", ), ;]}, {'_type': 'struct', 'modifier': [struct], 'name': [Colour], 'properties': [{'_type': 'property', 'type': [int], 'name': [red], 'default': [0]}, {'_type': 'property', 'type': [int], 'name': [green], 'default': [0]}, {'_type': 'property', 'type': [int], 'name': [blue], 'default': [0]}]}, {'_type': 'variable', 'type': [Colour], 'name': [colour], 'default': [Colour, (, 1, ,, 1, ,, 1, )]}]}
 """
 
 print_c = """
@@ -955,10 +2372,16 @@ print_c = """
 #---------------------------------------------------------------------------------
 # pretty-print the ast, matching line layout to source
 
+# true for a non-empty list of lexemes, or a TokenRange
+def is_lex_list(val) -> bool:
+    return (isinstance(val, TokenRange) or isinstance(val, List)) and len(val) > 0 and is_lex(val[0])
+
+# pretty_print_ast_markers is the original: one string with "**line: " markers, then split and regrouped by line
+# kept as the reference for pretty_print_ast below
 def pretty_print_ast_rec(ast):
     iLine = 0
     for key, val in ast.items():
-        if isinstance(val, List) and len(val) > 0 and isinstance(val[0], Lex):
+        if is_lex_list(val):
            iLineLex = val[0].location().line
            if iLine ==0 or iLineLex < iLine:
                iLine = iLineLex
@@ -966,7 +2389,7 @@ def pretty_print_ast_rec(ast):
     for key, val in ast.items():
         if isinstance(val, str):
             line += f"{val} ▶︎ "
-        elif isinstance(val, List) and len(val) > 0 and isinstance(val[0], Lex):
+        elif is_lex_list(val):
             iLineLex = val[0].location().line
             if iLineLex > iLine:
                 line += f"**{iLineLex}: "
@@ -980,7 +2403,7 @@ def pretty_print_ast_rec(ast):
                 line += f"{str(lex)}" + " "
             if line[-1]==' ': line = line[:-1]
             line += "\" "
-        elif isinstance(val, List) and (len(val) == 0 or not (isinstance(val[0], Lex))):
+        elif isinstance(val, (List, TokenRange)) and not is_lex_list(val):
             line += f"{key}: [ "
             for i, subitem in enumerate(val):
                 line += f"{pretty_print_ast_rec(subitem)}"
@@ -988,7 +2411,7 @@ def pretty_print_ast_rec(ast):
             line += "] "
     return line
 
-def pretty_print_ast(ast):
+def pretty_print_ast_markers(ast):
     out = pretty_print_ast_rec(ast)
     outlines = out.split("**")[1:]
     result = []
@@ -1005,6 +2428,55 @@ def pretty_print_ast(ast):
             res += f"{i:3}: {line}" + "\n"
     return res
 
+# pretty_print_ast: one pass over the ast, appending each piece of text to the bucket of the line it's on
+# a node starts on its earliest field's line; text stays on the current line until a lexeme moves it on
+def pretty_print_ast(ast) -> str:
+    buckets = [[]]
+    bucket = buckets[0]
+
+    # (line, text) of each lexeme in a lexeme list; TokenRanges read their buffer's columns directly
+    def lines_words(val) -> List[Tuple[int, str]]:
+        if isinstance(val, TokenRange) and isinstance(val.lexemes, TokenBuffer):
+            buffer = val.lexemes
+            starts, lineStarts = buffer.starts, buffer.source.lineStarts()
+            return [(bisect.bisect_right(lineStarts, starts[i]), buffer.val(i)) for i in range(val.iStart, val.iEnd)]
+        return [(lex.source.lineColumn(lex.iStart)[0] if lex.source else 1, str(lex)) for lex in val]
+
+    def goto(iLine: int):
+        nonlocal bucket
+        while iLine >= len(buckets): buckets.append([])
+        bucket = buckets[iLine]
+
+    def rec(ast):
+        iLine = 0
+        fields = []
+        for key, val in ast.items():
+            words = lines_words(val) if is_lex_list(val) else None
+            if words and (iLine == 0 or words[0][0] < iLine): iLine = words[0][0]
+            fields.append((key, val, words))
+        goto(iLine)
+        for key, val, words in fields:
+            if isinstance(val, str):
+                bucket.append(f"{val} ▶︎ ")
+            elif words:
+                for i, (iLineLex, word) in enumerate(words):
+                    if i > 0: bucket.append(" ")
+                    if iLineLex > iLine:
+                        goto(iLineLex)
+                        iLine = iLineLex
+                    if i == 0: bucket.append(f"{key}: \"")
+                    bucket.append(word)
+                bucket.append("\" ")
+            elif isinstance(val, (List, TokenRange)):
+                bucket.append(f"{key}: [ ")
+                for i, subitem in enumerate(val):
+                    rec(subitem)
+                    if i < len(val)-1: bucket.append(", ")
+                bucket.append("] ")
+
+    rec(ast)
+    return "".join(f"{i:3}: {''.join(buckets[i])}\n" for i in range(1, len(buckets)))
+
 #---------------------------------------------------------------------------------
 # extract code from markdown file
 
@@ -1033,6 +2505,51 @@ def extractCode(source: SourceFile) -> List[SourceRange]:
         iChar += len(line) + 1
     return ranges
 
+# extract_ranges: the code blocks of a markdown source as SourceRanges, yielded one at a time
+# finds fence and indent transitions with regex searches instead of splitting the text into lines;
+# blocks are as extractCode's, except that the last line counts even with no '\n' after it
+# the patterns match the '\n' before the line they're after, so the regex engine can skip ahead to each '\n'
+# given a (language), only blocks holding its code come out: fences that are untagged or tagged with
+# language.ext() ("```ts"), not ```text, ```json, ```fnf-skip etc; indented blocks only if (indented)
+s_block_start = re.compile(r'\n(?:```|    )')
+s_fence = re.compile(r'\n```')
+s_unindented = re.compile(r'\n(?!    )')
+
+# does a fence with info string (info) hold (language)'s code?
+def fence_wanted(info: str, language: 'Language') -> bool:
+    words = info.split()
+    return len(words) == 0 or words[0] == language.ext()
+
+def extract_ranges(source: SourceFile, language: 'Language'=None, indented: bool=True):
+    text = source.text
+    i = 0
+    while True:
+        if i == 0 and text.startswith(("```", "    ")): iLine = 0
+        else:
+            m = s_block_start.search(text, max(0, i - 1))
+            if m is None: return
+            iLine = m.start() + 1
+        if text.startswith("```", iLine):
+            iStart = text.find('\n', iLine) + 1
+            if iStart == 0: return                  # a fence on the last line opens nothing
+            wanted = language is None or fence_wanted(text[iLine+3:iStart-1], language)
+            close = s_fence.search(text, iStart - 1)
+            if close is None:
+                if wanted: yield SourceRange(source, iStart)
+                return
+            if wanted: yield SourceRange(source, iStart, close.start())
+            iLine = close.start() + 1
+        else:
+            end = s_unindented.search(text, iLine)
+            if end is None or end.start() == len(text) - 1:
+                if indented: yield SourceRange(source, iLine)
+                return
+            if indented: yield SourceRange(source, iLine, end.start())
+            iLine = end.start() + 1
+        # the line that ended the block can't start another one
+        i = text.find('\n', iLine) + 1
+        if i == 0: return
+
 test_md = """
 # Hello
 
@@ -1067,8 +2584,134 @@ feature Hello extends Feature {
 ]
 """
 
+#---------------------------------------------------------------------------------
+# ParseCache keeps each feature's tokens and ast on disk, keyed by a hash of its text, language and grammar
+# an entry is one marshal'd file: the token columns as raw arrays, the words they use (word ids differ
+# between runs), and the ast with each TokenRange as (iStart, iEnd) and each node as (type, fields, values)
+# loading touches an entry; storing evicts least-recently-used entries until the folder is under (maxBytes)
+# "--no-cache" on the command line (s_parse_cache_enabled = False) parses everything afresh
+
+s_parse_cache_version = 1
+s_parse_cache_enabled = True
+
+# the ast as marshal-able values
+def encode_ast(val):
+    if isinstance(val, TokenRange): return (val.iStart, val.iEnd)
+    if isinstance(val, AstNode): return (val._type, val._fields, { key: encode_ast(v) for key, v in val.items() if key != '_type' })
+    if isinstance(val, dict): return { key: encode_ast(v) for key, v in val.items() }
+    if isinstance(val, List): return [encode_ast(v) for v in val]
+    if isinstance(val, str): return val
+    raise ValueError(f"encode_ast: can't store {builtins.type(val).__name__}")
+
+# the ast encode_ast() encoded, with its TokenRanges into (lexemes)
+def decode_ast(val, lexemes):
+    kind = builtins.type(val)
+    if kind is tuple:
+        if len(val) == 2: return TokenRange(lexemes, val[0], val[1])
+        node = ast_node_class(val[0], val[1])
+        ast = node() if node else { '_type' : val[0] }
+        for key, v in val[2].items(): ast[key] = decode_ast(v, lexemes)
+        return ast
+    if kind is dict: return { key: decode_ast(v, lexemes) for key, v in val.items() }
+    if kind is builtins.list: return [decode_ast(v, lexemes) for v in val]
+    return val
+
+class ParseCache:
+    def __init__(self, folder: str, maxBytes: int=256*1024*1024):
+        self.folder = folder
+        self.maxBytes = maxBytes
+        self.entries = None         # key => size, least recently used first; read from the folder when first needed
+        self.totalBytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, text: str, language: 'Language', indented: bool) -> str:
+        digest = hashlib.sha1(text.encode())
+        digest.update(f"|{language.ext()}|{indented}|{grammar_digest(language)}|{s_parse_cache_version}|{sys.version_info[:2]}|{sys.byteorder}".encode())
+        return digest.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.folder, key + ".fnfc")
+
+    # (TokenBuffer, ast) for (source) stored under (key), or None; an entry that won't load is removed
+    def load(self, key: str, source: SourceFile):
+        path = self.path(key)
+        try:
+            with open(path, "rb") as file: data = file.read()
+        except OSError:
+            self.misses += 1
+            return None
+        try:
+            version, words, starts, ends, kinds, local, matches, ast = marshal.loads(data)
+            buffer = TokenBuffer(source)
+            for column, data in [(buffer.starts, starts), (buffer.ends, ends), (buffer.kinds, kinds), (buffer.matches, matches)]:
+                column.frombytes(data)
+            wids = [word_id(word) if word else 0 for word in words]
+            buffer.ids = array('I', map(wids.__getitem__, array('I', local)))
+            if not len(buffer.starts) == len(buffer.ends) == len(buffer.kinds) == len(buffer.ids) == len(buffer.matches):
+                raise ValueError("ParseCache: columns differ in length")
+            ast = decode_ast(ast, buffer)
+        except Exception:
+            self.misses += 1
+            self.remove(key)
+            return None
+        try: os.utime(path)
+        except OSError: pass
+        self.touch(key)
+        self.hits += 1
+        return buffer, ast
+
+    def store(self, key: str, buffer: TokenBuffer, ast):
+        table = {}                  # word id => index in words
+        local = array('I', [table.setdefault(wid, len(table)) for wid in buffer.ids])
+        words = [s_words[wid] if wid else None for wid in table]
+        try: encoded = encode_ast(ast)
+        except ValueError: return   # not something we can store; it'll be parsed again next time
+        data = marshal.dumps((s_parse_cache_version, words, buffer.starts.tobytes(), buffer.ends.tobytes(), buffer.kinds.tobytes(),
+                              local.tobytes(), buffer.matches.tobytes(), encoded))
+        if self.entries is None: self.scan()
+        try:
+            writeFileAtomically(self.path(key), data)
+        except OSError:
+            return                  # nowhere to keep it; the parse still stands
+        self.totalBytes += len(data) - self.entries.pop(key, 0)
+        self.entries[key] = len(data)
+        self.evict()
+
+    # what's in the folder, least recently used first
+    def scan(self):
+        found = []
+        try:
+            with os.scandir(self.folder) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".fnfc"):
+                        stat = entry.stat()
+                        found.append((stat.st_mtime, entry.name[:-5], stat.st_size))
+        except OSError:
+            pass
+        found.sort()
+        self.entries = { key: size for mtime, key, size in found }
+        self.totalBytes = sum(size for mtime, key, size in found)
+
+    def touch(self, key: str):
+        if self.entries is not None and key in self.entries: self.entries[key] = self.entries.pop(key)
+
+    def remove(self, key: str):
+        if self.entries is not None and key in self.entries: self.totalBytes -= self.entries.pop(key)
+        try: os.remove(self.path(key))
+        except OSError: pass
+
+    def evict(self):
+        while self.totalBytes > self.maxBytes and len(self.entries) > 1:
+            self.remove(next(iter(self.entries)))
+
+s_parse_cache = ParseCache(os.path.join(s_cache_folder, "parses"))
+
 #---------------------------------------------------------------------------------
 # Feature collects source, code, lexemes, ast for a particular sourcefile
+# only fences for the feature's language (or untagged) are code; s_indented_code says whether indented blocks are
+
+s_indented_code = True
 
 class Feature:
     def __init__(self, source: SourceFile):
@@ -1082,23 +2725,115 @@ class Feature:
         return Language.find(ext)
 
     def parse(self):
-        self.ranges = extractCode(self.source)
-        print(self.ranges)
-        self.lexemes = lexer(self.ranges, self.language.indentChar())
-        reader = Reader(self.lexemes)
-        parser = feature(self.language)
+        cache = s_parse_cache if s_parse_cache_enabled and not s_profile_enabled else None
+        key = cache.key(self.source.text, self.language, s_indented_code) if cache else None
+        cached = cache.load(key, self.source) if cache else None
+        if cached:
+            self.lexemes, self.ast = cached
+            return
+        self.lexemes = tokenise(extract_ranges(self.source, self.language, s_indented_code), self.language.indentChar(), self.source)
+        reader = Reader(self.lexemes, ranges=True)
+        parser = compiled_grammar(self.language) if s_compiled_enabled and not s_profile_enabled else grammar(self.language)
         self.ast = parser(reader)
+        if err(self.ast): self.ast = reader.diagnostic()
+        elif cache: cache.store(key, self.lexemes, self.ast)
 
     def err(self)->bool:
         return err(self.ast)
-    
+
+    # print the ast back as source text, streaming into (out)
+    def write_text(self, out):
+        writer = TextWriter(out, self.language)
+        grammar(self.language)(writer, self.ast)
+        writer.finish()
+
+    def name(self) -> str:
+        return str(self.ast['name'][0])
+
+    # the feature this one extends, or None
+    def parentName(self) -> str:
+        return str(self.ast['parent'][0]) if 'parent' in self.ast else None
+
+#---------------------------------------------------------------------------------
+# FeatureGraph: which parsed feature extends which
+# features extending Feature (or nothing) are roots; every other feature comes after the one it extends.
+# order is a depth-first walk from the roots, taking roots and children in the order the features came in,
+# so it's the same every run and each root's subtree is contiguous; subtrees don't depend on each other,
+# so they can be processed concurrently. Building it is linear in the number of features.
+
+s_root_feature = "Feature"
+
+class FeatureGraph:
+    def __init__(self, features: List[Feature]):
+        names = [feature.name() for feature in features]
+        parents = [feature.parentName() for feature in features]
+        first = {}                  # name => index of the first feature with that name
+        self.duplicates = []        # features with the same name as an earlier one
+        for i, name in enumerate(names):
+            if name in first: self.duplicates.append(features[i])
+            else: first[name] = i
+        self.byName = { name: features[i] for name, i in first.items() }
+        self.missing = []           # (feature, name of the parent that isn't there)
+        roots = []                  # indices of features extending Feature, nothing, or a feature that isn't there
+        children = {}               # index => indices of the features extending it, in the order given
+        iParents = [-1] * len(features)
+        for i, parent in enumerate(parents):
+            if first[names[i]] != i: continue
+            if parent is None or parent == s_root_feature: roots.append(i)
+            elif parent in first:
+                iParents[i] = first[parent]
+                children.setdefault(iParents[i], []).append(i)
+            else:
+                self.missing.append((features[i], parent))
+                roots.append(i)
+        self.subtrees = [[features[i] for i in self.walk(root, children)] for root in roots]
+        self.order = [feature for subtree in self.subtrees for feature in subtree]
+        self.cycles = self.find_cycles(features, iParents)
+
+    # index (root) and the indices of everything that extends it, parents first
+    def walk(self, root: int, children: dict) -> List[int]:
+        out = []
+        stack = [root]
+        while stack:
+            i = stack.pop()
+            out.append(i)
+            below = children.get(i)
+            if below: stack += reversed(below)
+        return out
+
+    # every feature not reached from a root leads up to a cycle; each cycle once, from its first-listed feature
+    def find_cycles(self, features: List[Feature], iParents: List[int]) -> List[List[Feature]]:
+        position = { builtins.id(feature): i for i, feature in enumerate(features) }
+        visited = [-2] * len(features)     # -1: ordered or a duplicate; otherwise the walk that got there first
+        for feature in self.order + self.duplicates: visited[position[builtins.id(feature)]] = -1
+        cycles = []
+        for iWalk in range(0, len(features)):
+            path = []
+            i = iWalk
+            while visited[i] == -2:
+                visited[i] = iWalk
+                path.append(i)
+                i = iParents[i]
+            if visited[i] == iWalk:
+                cycle = path[path.index(i):]
+                iFirst = cycle.index(min(cycle))
+                cycles.append([features[j] for j in cycle[iFirst:] + cycle[:iFirst]])
+        return cycles
+
+    # (path, message) for everything that stops the features being ordered
+    def problems(self) -> List[Tuple[str, str]]:
+        out = [(feature.source.path, f"feature {feature.name()} is defined again (first in {self.byName[feature.name()].source.path})") for feature in self.duplicates]
+        out += [(feature.source.path, f"feature {feature.name()} extends {parent}, which doesn't exist") for feature, parent in self.missing]
+        out += [(cycle[0].source.path, "features extend each other in a cycle: " + " extends ".join(feature.name() for feature in cycle + cycle[:1])) for cycle in self.cycles]
+        return out
 
 #---------------------------------------------------------------------------------
 # Context is a list of features that gets built and run
 
 class Context:
-    def __init__(self, features: List[Feature]):
+    def __init__(self, features: List[Feature], out=None):
         self.features = features
+        self.out = out              # where errors and the profile are reported; stdout if None
         self.compose()
 
     def compose(self):
@@ -1109,9 +2844,14 @@ class Context:
         for feature in self.features:
             feature.parse()
             if feature.err():
-                log(f"Error in {feature.source.path}:")
-                log(feature.ast)
+                report_error(feature.source.path, feature.ast, self.out)
                 exit(0)
+
+        self.graph = FeatureGraph(self.features)
+        problems = self.graph.problems()
+        for path, message in problems: report_problem(path, message, self.out)
+        if problems: exit(0)
+        self.features = self.graph.order
         
         for feature in self.features:
             for component in feature.ast['components']:
@@ -1123,6 +2863,13 @@ class Context:
                 elif component['_type'] == 'variable':
                     log(f"Variable: {name}")
 
+        if s_profile_enabled: report_profile(self.out)
+
+    # print every feature back as source text, one after another, into (out)
+    def write_text(self, out):
+        for feature in self.features:
+            feature.write_text(out)
+
     
 #---------------------------------------------------------------------------------
 # test routines
@@ -1133,6 +2880,91 @@ def test_extract():
     ranges = extractCode(source)
     log_assert(expected_ranges, ranges)
 
+# a literate feature document: mostly prose and tables, with the code in (code) spread through it
+def docs_document(code: str, nBlocks: int) -> str:
+    lines = code.strip().split("\n")
+    table = "| name | type | default |\n|------|------|---------|\n" + "| red | number | 0 |\n" * 20
+    prose = "The colour of a greeting depends on who is being greeted, and how well we know them.\n" * 8
+    out = "# Docs\n\n```\n" + lines[0] + "\n```\n\n"
+    for i in range(0, nBlocks):
+        block = "\n".join(lines[1:-1])
+        out += prose + "\n" + table + "\n" + (f"```\n{block}\n```\n\n" if i % 2 else "\n".join("    " + line for line in lines[1:-1]) + "\n\n")
+    return out + "That's all.\n"
+
+# extract_ranges finds the blocks extractCode does, lazily, and doesn't drop the last line
+def test_extract_ranges():
+    print("\ntest_extract_ranges ------------------------------------------\n")
+    source = SourceFile(None, test_md)
+    log_assert(expected_ranges, [range for range in extract_ranges(source)])
+    for text in [stress_document(test_code_ts, 3), docs_document(test_code_ts, 5), docs_document(test_code_py, 4)]:
+        source = SourceFile(None, "")
+        source.text = text
+        spans = [(range.iStart, range.iEnd) for range in extract_ranges(source)]
+        log_assert("True", spans == [(range.iStart, range.iEnd) for range in extractCode(source)])
+        log_assert("True", str(tokenise(extract_ranges(source), "{", source)) == str(tokenise(extractCode(source))))
+        log_assert("True", str(tokenise(extract_ranges(source), "{")) == str(tokenise(extractCode(source))))
+    source = SourceFile(None, "Code:\n```\nlocal x: number = 1;\n```")
+    log_assert("[\nlocal x: number = 1;\n```\n]", extractCode(source))
+    log_assert("[\nlocal x: number = 1;\n]", [range for range in extract_ranges(source)])
+    log_assert("0", len(tokenise(extract_ranges(SourceFile(None, "No code here.")))))
+
+fences_md = """
+# Colours
+
+Build it like this:
+
+```sh
+$ fnf build Colours.fnf.ts.md
+```
+
+```ts
+feature Colours extends Feature {
+    struct Colour { red: number = 0; }
+```
+
+A colour prints like:
+
+```json
+{ "red": 0 }
+```
+
+or in python:
+
+```py
+feature Colours extends Feature:
+```
+
+```fnf-skip
+on broken(
+```
+
+```
+    local c: Colour = new Colour();
+```
+
+and notes:
+
+    sketch: not code yet
+
+That's all.
+"""
+
+# only fences for the feature's language (or untagged) reach the lexer; indented blocks are optional
+def test_fences():
+    global s_indented_code
+    print("\ntest_fences --------------------------------------------------\n")
+    source = SourceFile(None, fences_md)
+    source.path = "Colours.fnf.ts.md"
+    log_assert("[\nfeature Colours extends Feature:\n, \n    local c: Colour = new Colour();\n]", [range for range in extract_ranges(source, Python(), False)])
+    log_assert("Expected 'feature' at Colours.fnf.ts.md:6:1:", str(grammar(Typescript())(Reader(tokenise(extractCode(source))))).split("    ◀︎")[0])
+    feature = Feature(source)
+    feature.parse()
+    log_assert("Expected ('on', 'replace', 'after', 'before') or ('struct', 'extend') or 'local' at Colours.fnf.ts.md:36:5:", str(feature.ast).split("    ◀︎")[0])
+    s_indented_code = False
+    feature.parse()
+    s_indented_code = True
+    log_assert("['struct', 'variable']", [component['_type'] for component in feature.ast['components']])
+
 def test_parser(language: Language, test_code, expected_lexemes, expected_ast, expected_print):
     print(f"\ntest_parser ({language.__class__.__name__}) -------------------------------------------------\n")
     source = SourceFile(None, test_code)
@@ -1154,11 +2986,541 @@ def test_parser(language: Language, test_code, expected_lexemes, expected_ast, e
     success = parser(writer, ast)
     log_assert(expected_print, writer.lexemes)
 
+# random snippets cut into random ranges: lexer() must agree with lexer_charwise() exactly
+lexer_fuzz_pieces = ['a', 'b', '_', 'x1', '9', '0', 'é', '²', '½', ' ', ' ', '    ', '\n', '\n', '\t', '\r',
+                     '{', '}', '(', ')', '[', ']', ':', ';', ',', '.', '=', '+', '-', '>', '!', '"', "'", '`', '\\', '#']
+
+def lex_signature(lexemes: List[Lex]) -> str:
+    return " ".join(f"{lex.iStart}:{lex.iEnd}:{repr(lex.val)}" for lex in lexemes)
+
+def test_lexer():
+    print("\ntest_lexer -------------------------------------------------\n")
+    rand = random.Random(1)
+    expected = []
+    result = []
+    for language in [Typescript(), Python(), C()]:
+        for code in [test_code_ts, test_code_py, test_code_c]:
+            ranges = [SourceRange(SourceFile(None, code))]
+            expected.append(lex_signature(lexer_charwise(ranges, language.indentChar())))
+            result.append(lex_signature(lexer(ranges, language.indentChar())))
+    for iTest in range(0, 500):
+        source = SourceFile(None, "")
+        source.text = "".join(rand.choice(lexer_fuzz_pieces) for _ in range(0, rand.randint(1, 80)))
+        cuts = sorted(rand.randint(1, len(source.text)) for _ in range(0, rand.randint(0, 3)))
+        ranges = [SourceRange(source, iStart, iEnd) for iStart, iEnd in zip([0] + cuts, cuts + [len(source.text)])]
+        for indentChar in ['{', ':', None]:
+            expected.append(lex_signature(lexer_charwise(ranges, indentChar)))
+            result.append(lex_signature(lexer(ranges, indentChar)))
+    log_disable()
+    log_assert("\n".join(expected), "\n".join(result))
+
+# a generated feature document: prose interleaved with (nBlocks) copies of the test code
+def stress_block(code: str) -> str:
+    lines = code.strip().split("\n")[1:-1]
+    return "Here's some prose about the code below.\n\n" + "\n".join("    " + line for line in lines) + "\n\n"
+
+def stress_document(code: str, nBlocks: int) -> str:
+    return f"# Stress\n\n    {code.strip().split("\n")[0]}\n\n" + stress_block(code) * nBlocks + "That's all.\n"
+
+# ~5MB of feature document: every lexeme must come out, in time linear in the size
+def test_lexer_stress():
+    print("\ntest_lexer_stress -------------------------------------------------\n")
+    for language, code in [(Typescript(), test_code_ts), (Python(), test_code_py)]:
+        nBlocks = 5_000_000 // len(stress_block(code))
+        one = len(lexer(extractCode(SourceFile(None, stress_document(code, 1))), language.indentChar()))
+        two = len(lexer(extractCode(SourceFile(None, stress_document(code, 2))), language.indentChar()))
+        expected = one + (two - one) * (nBlocks - 1)
+        for size, n in [("0.5MB", nBlocks // 10), ("5MB", nBlocks)]:
+            source = SourceFile(None, stress_document(code, n))
+            start = time.perf_counter()
+            nLex = 0
+            for lex in lex_stream(extractCode(source), language.indentChar()):
+                nLex += 1
+            elapsed = time.perf_counter() - start
+            print(f"{language.__class__.__name__} {size}: {nLex} lexemes in {elapsed:.2f} sec ({len(source.text) / elapsed / 1e6:.2f} MB/sec)")
+        log_assert(f"{expected}", nLex)
+
+# a TokenBuffer must hold the same lexemes as lexer(), and parse/print the same way
+def test_token_buffer():
+    print("\ntest_token_buffer -------------------------------------------------\n")
+    for language, code in [(Typescript(), test_code_ts), (Python(), test_code_py), (C(), test_code_c)]:
+        ranges = [SourceRange(SourceFile(None, code))]
+        log_assert(lex_signature(lexer(ranges, language.indentChar())), lex_signature(tokenise(ranges, language.indentChar())))
+    lexemes = tokenise([SourceRange(SourceFile(None, test_code_ts))], "{")
+    log_assert(lexemes_ts, lexemes)
+    ast = feature(Typescript())(Reader(lexemes))
+    log_assert(ast_ts, ast)
+    expected_pretty = pretty_print_ast(feature(Typescript())(Reader(lexer([SourceRange(SourceFile(None, test_code_ts))]))))
+    log_assert(expected_pretty, pretty_print_ast(ast).strip())
+
+# the lexer classifies each token; a Reader over plain Lex objects must see the same kinds and ids
+def test_token_kinds():
+    print("\ntest_token_kinds -------------------------------------------------\n")
+    source = SourceFile(None, 'on f(x) { print("hi", 42) >= x; }')
+    buffer = tokenise([SourceRange(source)], "{")
+    names = { TOKEN_INDENT: "indent", TOKEN_UNDENT: "undent", TOKEN_NEWLINE: "newline", TOKEN_ID: "id", TOKEN_NUMBER: "number",
+              TOKEN_STRING: "string", TOKEN_PUNCTUATION: "punctuation", TOKEN_OPERATOR: "operator" }
+    log_assert("on:id f:id (:punctuation x:id ):punctuation {indent}:indent print:id (:punctuation \"hi\":string ,:punctuation 42:number ):punctuation >=:operator x:id ;:punctuation {undent}:undent",
+               " ".join(f"{buffer.val(i)}:{names[buffer.kinds[i]]}" for i in range(0, len(buffer))))
+    reader = Reader(lexer([SourceRange(source)], "{"))
+    log_assert(f"{buffer.kinds.tolist()} {buffer.ids.tolist()}", reader.kinds.tolist(), reader.ids.tolist())
+    log_assert("True True 0", buffer.ids[0] == word_id("on"), buffer.ids[3] == buffer.ids[13], buffer.ids[8])
+
+# line/column from the line-start table must match counting newlines from the start
+def test_locations():
+    print("\ntest_locations -------------------------------------------------\n")
+    expected = []
+    result = []
+    for text in [test_md, test_code_ts, test_code_py, "\n\nx\n", "x"]:
+        source = SourceFile(None, "")
+        source.text = text
+        for iChar in range(0, len(text) + 1):
+            line = 1
+            iCr = 0
+            for i in range(0, iChar):
+                if text[i] == '\n':
+                    iCr = i
+                    line += 1
+            expected.append(f"{line}:{iChar - iCr}")
+            result.append(f"{source.findLocation(iChar).line}:{source.findLocation(iChar).column}")
+    log_assert(" ".join(expected), " ".join(result))
+    lexemes = lexer([SourceRange(SourceFile(None, test_code_ts))])
+    log_assert(":10:9 :18:1", lexemes[60].location(), lexemes[-1].location())
+
+# a grammar whose alternatives share a prefix parser: locals with and without a default value
+def shared_prefix_grammar():
+    decl = sequence(keyword('local'), set('name', id()), keyword(':'), set('type', id()))
+    return list(anyof(
+        label('variable', sequence(decl, keyword('='), set('default', upto([';'])), keyword(';'))),
+        label('variable', sequence(decl, keyword(';'))),
+        label('struct', sequence(keyword('struct'), set('name', id()), indent(),
+            set('properties', list_separated(label('property', Typescript().parameter()), ';', '{undent}'))))), '{undent}')
+
+shared_prefix_code = """
+local a: number;
+local b: Colour = new Colour(1, 2, 3);
+struct Colour { red: number = 0; green: number; }
+local c: string;
+"""
+
+# packrat parsing gives the same ASTs, and remembers the shared prefix instead of parsing it twice
+def test_packrat():
+    print("\ntest_packrat -------------------------------------------------\n")
+    for language, code, expected_ast in [(Typescript(), test_code_ts, ast_ts), (Python(), test_code_py, ast_py), (C(), test_code_c, ast_c)]:
+        reader = Reader(lexer([SourceRange(SourceFile(None, code))], language.indentChar()), packrat=True)
+        log_assert(expected_ast, feature(language)(reader))
+    lexemes = lexer([SourceRange(SourceFile(None, shared_prefix_code))])
+    parser = shared_prefix_grammar()
+    reader = Reader(lexemes, packrat=True)
+    log_assert(str(parser(Reader(lexemes))), parser(reader))
+    log_assert("packrat: 2 hits, 27 misses (7% hits), 8 tokens skipped", reader.memo_stats())
+
+# FIRST sets pick the alternatives anyof tries; a token no alternative starts with gives the full ordered error
+def test_first_sets():
+    print("\ntest_first_sets ----------------------------------------------\n")
+    ts = Typescript()
+    log_assert("['after', 'before', 'extend', 'local', 'on', 'replace', 'struct']", str(first_of(component(ts))))
+    log_assert("[] kinds [4]", str(first_of(ts.parameter())))
+    log_assert("['local'] nullable", str(first_of(optional(keyword('local')))))
+    code = "struct Colour { red: number; }\n"
+    parser = anyof(label('variable', sequence(keyword('local'), set('name', id()))), label('struct', sequence(keyword('struct'), set('name', id()))))
+    log_assert("{'_type': 'struct', 'name': [Colour]}", str(parser(Reader(lexer([SourceRange(SourceFile(None, code))])))))
+    error = parser(Reader(lexer([SourceRange(SourceFile(None, "const x;\n"))])))
+    log_assert("'local' or 'struct'", error.expected)
+    # failing at the bottom tries each "(" once, not once per way of reaching it
+    calls = [0]
+    parser = nested_anyof_grammar(16, calls)
+    lexemes = lexer([SourceRange(SourceFile(None, "(" * 16 + " ;"))])
+    log_assert("True 16", err(parser(Reader(lexemes))), calls[0])
+    calls[0] = 0
+    log_assert("True 16", err(IterativeParser(parser)(Reader(lexemes))), calls[0])
+
+# a grammar (depth) anyofs deep, counting in (calls) how often it tries "("
+def nested_anyof_grammar(depth: int, calls: List[int]):
+    bracket = keyword('(')
+    def counted(reader: Reader):
+        calls[0] += 1
+        return bracket(reader)
+    counted.rule, counted.first = bracket.rule, bracket.first
+    parser = id()
+    for i in range(0, depth):
+        parser = anyof(sequence(counted, set('inner', parser), keyword(')')), keyword('x'))
+    return parser
+
+# each language's grammar is built once and shared; a cached grammar parses the same as a fresh one
+def test_grammar_cache():
+    print("\ntest_grammar_cache -------------------------------------------\n")
+    log_assert("True", str(grammar(Typescript()) is grammar(Typescript())))
+    log_assert("False", str(grammar(Typescript()) is grammar(Python())))
+    reader = Reader(lexer([SourceRange(SourceFile(None, test_code_ts))], "{"))
+    log_assert(ast_ts, grammar(Typescript())(reader))
+
+# the compiled grammar gives the same ASTs and the same errors as the interpreted one
+def test_compiler():
+    global s_cache_folder
+    print("\ntest_compiler ------------------------------------------------\n")
+    for language, code, expected_ast in [(Typescript(), test_code_ts, ast_ts), (Python(), test_code_py, ast_py), (C(), test_code_c, ast_c)]:
+        lexemes = tokenise([SourceRange(SourceFile(None, code))], language.indentChar())
+        log_assert(expected_ast, compiled_grammar(language)(Reader(lexemes)))
+    broken = test_code_ts.replace("on output(", "on (")
+    lexemes = tokenise([SourceRange(SourceFile(None, broken))], "{")
+    expected = grammar(Typescript())(Reader(lexemes))
+    log_assert(f"{expected} {expected.iLex}", compiled_grammar(Typescript())(Reader(lexemes)), expected.iLex)
+    log_assert(ast_ts, compiled_grammar(Typescript())(Reader(tokenise([SourceRange(SourceFile(None, test_code_ts))]), packrat=True)))
+    # with nowhere to cache the module, it runs from memory
+    saved = s_cache_folder
+    with tempfile.NamedTemporaryFile() as file:
+        s_cache_folder = os.path.join(file.name, "fnf")
+        try: parser = compile_grammar(grammar(Typescript()))
+        finally: s_cache_folder = saved
+    log_assert(ast_ts, parser(Reader(tokenise([SourceRange(SourceFile(None, test_code_ts))]))))
+    log_assert("True", str(parser.__code__.co_filename.startswith("<grammar_")))
+    # writers racing on one module each write a file of their own, and the last whole one wins
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "grammar.py")
+        texts = [f"# writer {i}\n" * 2000 for i in range(0, 8)]
+        def write(text: str):
+            for i in range(0, 20): writeFileAtomically(path, text)
+        with ThreadPoolExecutor(8) as pool:
+            for future in [pool.submit(write, text) for text in texts]: future.result()
+        log_assert("True ['grammar.py']", readTextFile(path) in texts, os.listdir(folder))
+
+# label() builds AstNodes that read like the dicts they replace
+def test_ast_nodes():
+    print("\ntest_ast_nodes -----------------------------------------------\n")
+    ast = grammar(Typescript())(Reader(tokenise([SourceRange(SourceFile(None, test_code_ts))])))
+    main = ast['components'][2]
+    log_assert("AstFeature AstFunction AstStruct", type(ast).__name__, type(main).__name__, type(ast['components'][3]).__name__)
+    log_assert("function [main] True False", main['_type'], main['name'], 'returnType' in main, 'default' in main)
+    log_assert("['_type', 'modifier', 'name', 'parameters', 'returnType', 'body']", main.keys())
+    log_assert("None", main.get('default'))
+    c = grammar(C())(Reader(tokenise([SourceRange(SourceFile(None, test_code_c))])))
+    log_assert("['_type', 'modifier', 'returnType', 'name', 'parameters', 'body']", c['components'][0].keys())
+
+# ranges=True: fields are TokenRanges into the token buffer, and everything downstream reads them the same way
+def test_token_ranges():
+    print("\ntest_token_ranges --------------------------------------------\n")
+    for language, code, expected_ast, expected_print in [(Typescript(), test_code_ts, ast_ts, print_ts), (Python(), test_code_py, ast_py, print_py), (C(), test_code_c, ast_c, print_c)]:
+        lexemes = tokenise([SourceRange(SourceFile(None, code))], language.indentChar())
+        ast = grammar(language)(Reader(lexemes, ranges=True))
+        log_assert(expected_ast, ast)
+        log_assert(expected_ast, compiled_grammar(language)(Reader(lexemes, ranges=True)))
+        log_assert("True", pretty_print_ast(grammar(language)(Reader(lexemes))) == pretty_print_ast(ast))
+        writer = Writer()
+        grammar(language)(writer, ast)
+        log_assert(expected_print, writer.lexemes)
+    ast = compiled_grammar(Typescript())(Reader(tokenise([SourceRange(SourceFile(None, test_code_ts))]), ranges=True))
+    body = ast['components'][1]['body']
+    log_assert("TokenRange 14 console message", type(body).__name__, len(body), body[0], body[-3])
+    log_assert('console.log("    ".repeat(indent) + message);', body.text())
+
+# tokenise fills in the bracket table as it lexes; upto() uses it to skip bodies
+def test_bracket_matches():
+    print("\ntest_bracket_matches -----------------------------------------\n")
+    lexemes = tokenise([SourceRange(SourceFile(None, test_code_ts))])
+    log_assert(str(bracket_matches(lexemes.ids)), lexemes.matches)
+    pairs = [f"{lexemes[i]}{i}:{lexemes[lexemes.matches[i]]}{lexemes.matches[i]}" for i in range(0, 30) if lexemes.ids[i] in s_open_ids]
+    log_assert("{indent}4:{undent}104 (7:)11 {indent}14:{undent}23 (16:)18 (26:)36", " ".join(pairs))
+    lexemes = tokenise([SourceRange(SourceFile(None, "a ( b [ c ) d"))])
+    log_assert("array('I', [0, 7, 0, 5, 0, 0, 0])", lexemes.matches)
+    ids = lexemes.ids
+    log_assert("7 3 5", upto_end(ids, lexemes.matches, len(ids), 0, frozenset([word_id("d")])), upto_end(ids, lexemes.matches, len(ids), 2, frozenset([word_id("[")])), upto_end(ids, lexemes.matches, len(ids), 4, frozenset([word_id(")")])))
+
+# failed matches reuse the reader's one Error; message and location are only made when asked for
+def test_lazy_errors():
+    print("\ntest_lazy_errors ---------------------------------------------\n")
+    reader = Reader(tokenise([SourceRange(SourceFile(None, "struct Colour {\n    red: number;\n}"))]))
+    first = keyword('local')(reader)
+    log_assert("True 'local' 0", first is reader.failure, first.expected, first.iLex)
+    kept = first.copy()
+    reader.i = 3
+    second = keyword(';')(reader)
+    log_assert("True ';' 3", second is first, first.expected, first.iLex)
+    log_assert("False 'local' 0 :1:0", kept is first, kept.expected, kept.iLex, kept.location)
+
+# failures are tracked quietly; the reader's diagnostic lists everything expected at the farthest token
+def test_farthest_failure():
+    print("\ntest_farthest_failure ----------------------------------------\n")
+    broken = test_code_ts.replace("blue: number = 0;", "blue: number 0;")
+    lexemes = tokenise([SourceRange(SourceFile(None, broken))])
+    diagnostics = []
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        for parser in [grammar(Typescript()), compiled_grammar(Typescript())]:
+            reader = Reader(lexemes)
+            error = parser(reader)
+            diagnostics.append(reader.diagnostic())
+    log_assert("", out.getvalue())
+    log_assert("Expected '=' or identifier at :15:22:", str(diagnostics[0]).split("    ◀︎")[0])
+    log_assert(str(diagnostics[0]), diagnostics[1])
+    reader = Reader(tokenise([SourceRange(SourceFile(None, test_code_ts))]))
+    grammar(Typescript())(reader)
+    log_assert("True", reader.farthest < reader.n)
+    out = io.StringIO()
+    report_error("Hello.fnf.ts.md", diagnostics[0], out)
+    log_assert("Error in Hello.fnf.ts.md: Expected '=' or identifier at :15:22:", out.getvalue().split("    ◀︎")[0])
+
+# printers roll back by truncating, and share one Lex per literal
+def test_writer():
+    print("\ntest_writer --------------------------------------------------\n")
+    writer = Writer()
+    parser = optional(sequence(keyword('local'), set('name', id())))
+    parser(writer, {})
+    log_assert("[]", writer.lexemes)
+    keyword('on')(writer, {})
+    mark = writer.mark()
+    indent()(writer, {})
+    indent()(writer, {})
+    log_assert("[on, {indent}, {indent}] True", writer.lexemes, writer.lexemes[1] is writer.lexemes[2])
+    writer.rollback(mark)
+    log_assert("[on]", writer.lexemes)
+
+# TextWriter prints source that parses back to the same ast, streaming the same text that formatting the printed lexemes gives
+def test_text_writer():
+    print("\ntest_text_writer --------------------------------------------\n")
+    for language, code in [(Typescript(), test_code_ts), (Python(), test_code_py), (C(), test_code_c)]:
+        parser = grammar(language)
+        for source in [code, repeat_components(code, 3)]:
+            ast = parser(Reader(tokenise([SourceRange(SourceFile(None, source))], language.indentChar())))
+            out = io.StringIO()
+            writer = TextWriter(out, language)
+            parser(writer, ast)
+            writer.finish()
+            lexWriter = Writer()
+            parser(lexWriter, ast)
+            reparsed = parser(Reader(tokenise([SourceRange(SourceFile(None, out.getvalue()))], language.indentChar())))
+            log_assert("False True True", err(reparsed), str(reparsed) == str(ast), out.getvalue() == format_lexemes(lexWriter.lexemes, language))
+    log_assert('print(f"Hello, {name}!")', format_lexemes([literal_lex(word) for word in ['print', '(', 'f', '"Hello, {name}!"', ')']], Python()).strip())
+    # nothing reaches the stream until the outermost mark is released; rollback drops it
+    out = io.StringIO()
+    writer = TextWriter(out, Typescript())
+    outer = writer.mark()
+    keyword('local')(writer, {})
+    inner = writer.mark()
+    indent()(writer, {})
+    writer.rollback(inner)
+    log_assert("'' 0", repr(out.getvalue()), writer.depth)
+    writer.release(outer)
+    writer.finish()
+    log_assert("'local\\n'", repr(out.getvalue()))
+
+# pretty_print_ast lays out the same text as the marker-splitting original, and isn't fooled by a "**" in the code
+def test_pretty_print():
+    print("\ntest_pretty_print --------------------------------------------\n")
+    for language, code in [(Typescript(), test_code_ts), (Python(), test_code_py), (C(), test_code_c)]:
+        for ranges in [False, True]:
+            ast = grammar(language)(Reader(tokenise([SourceRange(SourceFile(None, repeat_components(code, 3)))], language.indentChar()), ranges=ranges))
+            log_assert("True", pretty_print_ast(ast) == pretty_print_ast_markers(ast))
+    code = "feature Power extends Feature {\n    on power(x: number): number {\n        return x ** 2;\n    }\n}"
+    ast = grammar(Typescript())(Reader(tokenise([SourceRange(SourceFile(None, code))])))
+    log_assert("True", pretty_print_ast(ast).split("\n")[2] == '  3: body: "return x ** 2 ;" ] ')
+
+# profiled grammars parse the same; every call is counted once, as a success or a failure
+def test_profiler():
+    print("\ntest_profiler ------------------------------------------------\n")
+    profile_enable()
+    profile_reset()
+    lexemes = tokenise([SourceRange(SourceFile(None, test_code_ts))])
+    log_assert(ast_ts, grammar(Typescript())(Reader(lexemes)))
+    rows = profile_rows()
+    log_assert("True", all(row['calls'] == row['successes'] + row['failures'] for row in rows))
+    log_assert("[105]", [row['consumed'] for row in rows if row['kind'] == 'label' and row['calls'] == 1 and row['consumed'] > 100])
+    log_assert("[(3, 28)]", [(row['calls'], row['consumed']) for row in rows if row['kind'] == 'upto' and row['calls'] == 3])
+    log_assert("True", json.loads(profile_json()) == json.loads(json.dumps(rows)))
+    # the first 'variable' alternative reads "local a: number" before failing at ';', twice
+    parser = shared_prefix_grammar()
+    profile_reset()
+    parser(Reader(lexer([SourceRange(SourceFile(None, shared_prefix_code))])))
+    log_assert("[(3, 1, 2, 8)]", [(row['calls'], row['successes'], row['failures'], row['backtracked']) for row in profile_rows() if row['kind'] == 'label' and row['backtracked'] > 0])
+    # a Context reports its profile into the stream it's given
+    source = SourceFile(None, "```ts\nfeature Solo extends Feature {\n    local x: number = 0;\n}\n```")
+    source.path = "Solo.fnf.ts.md"
+    profile_reset()
+    out = io.StringIO()
+    Context([Feature(source)], out)
+    report = out.getvalue().splitlines()
+    log_assert("where True", report[0].split()[0], any(line.split()[1] == 'label' for line in report[1:]))
+    profile_disable()
+    log_assert("despatch_label despatch_profiled", grammar(Typescript()).__name__, s_grammars[(Typescript, True)].__name__)
+
+# a grammar (depth) groups deep: "( ( ... x ... ) )"
+def nested_grammar(depth: int):
+    parser = set('leaf', id())
+    for i in range(0, depth):
+        parser = label('group', sequence(keyword('('), set('inner', parser), keyword(')')))
+    return parser
+
+def nested_code(depth: int) -> str:
+    return "(" * depth + " x " + ")" * depth
+
+# depth of nested groups in an ast, without recursing
+def nested_depth(ast) -> int:
+    depth = 0
+    while 'inner' in ast:
+        ast = ast['inner']
+        depth += 1
+    return depth
+
+# the iterative engine gives the recursive engine's results and errors, and doesn't mind depth
+def test_iterative():
+    print("\ntest_iterative -----------------------------------------------\n")
+    for language, code, expected_ast in [(Typescript(), test_code_ts, ast_ts), (Python(), test_code_py, ast_py), (C(), test_code_c, ast_c)]:
+        lexemes = tokenise([SourceRange(SourceFile(None, code))], language.indentChar())
+        log_assert(expected_ast, IterativeParser(grammar(language))(Reader(lexemes)))
+        log_assert(expected_ast, IterativeParser(grammar(language))(Reader(lexemes, packrat=True, ranges=True)))
+    lexemes = tokenise([SourceRange(SourceFile(None, test_code_ts.replace("on output(", "on (")))])
+    recursive, iterative = Reader(lexemes), Reader(lexemes)
+    expected = grammar(Typescript())(recursive)
+    log_assert(f"{expected} {recursive.diagnostic()}", IterativeParser(grammar(Typescript()))(iterative), iterative.diagnostic())
+    parser = shared_prefix_grammar()
+    lexemes = lexer([SourceRange(SourceFile(None, shared_prefix_code))])
+    recursive, iterative = Reader(lexemes, packrat=True), Reader(lexemes, packrat=True)
+    log_assert(f"{parser(recursive)} {recursive.memo_stats()}", IterativeParser(parser)(iterative), iterative.memo_stats())
+    parser = nested_grammar(100)
+    lexemes = lexer([SourceRange(SourceFile(None, nested_code(100)))])
+    log_assert(str(parser(Reader(lexemes))), IterativeParser(parser)(Reader(lexemes)))
+    for depth in [2000, 5000]:
+        parser = nested_grammar(depth)
+        lexemes = tokenise([SourceRange(SourceFile(None, nested_code(depth)))])
+        try:
+            parser(Reader(lexemes))
+            recursed = "parsed"
+        except RecursionError:
+            recursed = "RecursionError"
+        ast = IterativeParser(parser)(Reader(lexemes))
+        log_assert(f"RecursionError {depth} True", recursed, nested_depth(ast), str(ast_leaf(ast)) == "{'leaf': [x]}")
+        error = IterativeParser(parser)(Reader(tokenise([SourceRange(SourceFile(None, nested_code(depth)[:-1]))])))
+        log_assert(f"')' {2*depth}", error.expected, error.iLex)
+
+# the innermost node of a nested_grammar ast
+def ast_leaf(ast):
+    while 'inner' in ast: ast = ast['inner']
+    return ast
+
 test_folder = "source/test"
 expected_files = """
-['source/test/Hello.fnf.ts.md', 'source/test/Hello/Goodbye.fnf.ts.md', 'source/test/Hello/Countdown.fnf.ts.md']
+['source/test/Hello.fnf.ts.md', 'source/test/Hello/Countdown.fnf.ts.md', 'source/test/Hello/Goodbye.fnf.ts.md']
 """
 
+# a tree of (nFolders) x (nSubfolders) folders with (nFiles) files each, half of them .fnf.ts.md
+def make_tree(root: str, nFolders: int, nSubfolders: int, nFiles: int):
+    for i in range(0, nFolders):
+        for j in range(0, nSubfolders):
+            folder = os.path.join(root, f"f{i}", f"s{j}")
+            os.makedirs(folder)
+            for k in range(0, nFiles):
+                open(os.path.join(folder, f"Feature{k}.fnf.ts.md" if k % 2 else f"notes{k}.txt"), "w").close()
+
+# scanFolder finds the same files serially or in parallel, in path order, and doesn't follow symlinked folders
+def test_scan():
+    print("\ntest_scan ----------------------------------------------------\n")
+    log_assert(expected_files, scanFolder(test_folder, ".md"))
+    log_assert(expected_files, scanFolder(os.path.join(currentWorkingDirectory(), test_folder), ".md", 4))
+    with tempfile.TemporaryDirectory() as root:
+        make_tree(root, 3, 4, 6)
+        os.symlink(os.path.join(root, "f0"), os.path.join(root, "f2", "loop"))
+        found = scanFolder(root, ".md")
+        log_assert("36 True True", len(found), found == sorted(found), found == scanFolder(root, ".md", 8))
+        log_assert("f0/s0/Feature1.fnf.ts.md f2/s3/Feature5.fnf.ts.md", os.path.relpath(found[0], root), os.path.relpath(found[-1], root))
+
+# a feature with (text), cached in (cache)
+def cached_feature(text: str, cache: ParseCache) -> Feature:
+    global s_parse_cache
+    source = SourceFile(None, text)
+    source.path = "Countdown.fnf.ts.md"
+    feature = Feature(source)
+    saved, s_parse_cache = s_parse_cache, cache
+    try: feature.parse()
+    finally: s_parse_cache = saved
+    return feature
+
+# a cached feature comes back with the same tokens and ast; changed, corrupt or evicted entries are parsed again
+def test_parse_cache():
+    global s_parse_cache_enabled
+    print("\ntest_parse_cache ---------------------------------------------\n")
+    text = readTextFile("source/test/Hello/Countdown.fnf.ts.md").strip()
+    with tempfile.TemporaryDirectory() as folder:
+        cache = ParseCache(folder)
+        cold = cached_feature(text, cache)
+        warm = cached_feature(text, cache)
+        log_assert("1 1 1", cache.hits, cache.misses, len(os.listdir(folder)))
+        log_assert("True", str(pretty_print_ast(cold.ast) == pretty_print_ast(warm.ast)))
+        columns = lambda buffer: (buffer.starts, buffer.ends, buffer.kinds, buffer.matches, [l.val for l in buffer])
+        log_assert("True", str(columns(cold.lexemes) == columns(warm.lexemes)))
+        log_assert("True", str(builtins.type(cold.ast) is builtins.type(warm.ast) and builtins.type(warm.ast) is not dict))
+        cached_feature(text.replace("whole new", "brand new"), cache)
+        log_assert("1 2 2", cache.hits, cache.misses, len(os.listdir(folder)))
+        key = cache.key(text, Typescript(), s_indented_code)
+        with open(cache.path(key), "wb") as file: file.write(b"not marshal")
+        log_assert("1 3", cache.hits, cached_feature(text, cache) and cache.misses)
+        cached_feature(text, cache)
+        log_assert("2", cache.hits)
+        path = cache.path(key)
+        with open(path, "rb") as file: version, words, starts, ends, kinds, local, matches, ast = marshal.loads(file.read())
+        for entry in [(version, words, starts[:-1], ends, kinds, local, matches, ast), (version, words, starts, ends, kinds, local, matches, (ast[0],))]:
+            with open(path, "wb") as file: file.write(marshal.dumps(entry))
+            log_assert("None False", cache.load(key, SourceFile(None, text)), os.path.exists(path))
+        log_assert("2 5 1", cache.hits, cache.misses, len(cache.entries))
+    with tempfile.TemporaryDirectory() as folder:
+        cache = ParseCache(folder, maxBytes=1)
+        for i in range(0, 3): cached_feature(text.replace("Countdown", f"Countdown{i}"), cache)
+        log_assert("1 True", len(os.listdir(folder)), cache.entries == { cache.key(text.replace("Countdown", "Countdown2"), Typescript(), s_indented_code): cache.totalBytes })
+        s_parse_cache_enabled = False
+        try: cached_feature(text.replace("Countdown", "Countdown3"), cache)
+        finally: s_parse_cache_enabled = True
+        log_assert("1 0 3", len(os.listdir(folder)), cache.hits, cache.misses)
+    with tempfile.NamedTemporaryFile() as file:
+        cache = ParseCache(os.path.join(file.name, "parses"))
+        log_assert("False 0 1 0", err(cached_feature(text, cache).ast), cache.hits, cache.misses, len(cache.entries))
+    # caches storing the same entry at once each write a file of their own, and leave one whole entry
+    with tempfile.TemporaryDirectory() as folder:
+        caches = [ParseCache(folder) for i in range(0, 8)]
+        stored = cached_feature(text, caches[0])
+        key = caches[0].key(text, Typescript(), s_indented_code)
+        def store(cache: ParseCache):
+            for i in range(0, 20): cache.store(key, stored.lexemes, stored.ast)
+        with ThreadPoolExecutor(8) as pool:
+            for future in [pool.submit(store, cache) for cache in caches]: future.result()
+        loaded = ParseCache(folder).load(key, SourceFile(None, text))
+        log_assert("1 True", len(os.listdir(folder)), loaded is not None and str(loaded[1]) == str(stored.ast))
+    # keys follow the grammar's rules, and making one doesn't compile anything
+    log_assert("True 3 True", rules_digest(feature(Typescript())) == grammar_digest(Typescript()), len({grammar_digest(language) for language in [Typescript(), Python(), C()]}),
+               rules_digest(nested_grammar(3)) != rules_digest(nested_grammar(4)))
+    compiled = dict(s_compiled_grammars)
+    s_compiled_grammars.clear()
+    try:
+        ParseCache("").key(text, Python(), True)
+        log_assert("0", len(s_compiled_grammars))
+    finally:
+        s_compiled_grammars.update(compiled)
+
+# a parsed feature (name) extending (parent), without a file
+def graph_feature(name: str, parent: str) -> Feature:
+    source = SourceFile(None, f"feature {name} extends {parent} {{")
+    source.path = f"{name}.fnf.ts.md"
+    feature = Feature(source)
+    feature.ast = compiled_grammar(Typescript())(Reader(tokenise([SourceRange(source)]), ranges=True))
+    return feature
+
+def feature_names(features: List[Feature]) -> str:
+    return " ".join(feature.name() for feature in features)
+
+# features come after what they extend, in an order that only depends on the order they came in
+def test_feature_graph():
+    print("\ntest_feature_graph -------------------------------------------\n")
+    features = [graph_feature(name, parent) for name, parent in [("Countdown", "Hello"), ("Sub", "Other"), ("Hello", "Feature"), ("Goodbye", "Hello"), ("Other", "Feature"), ("Later", "Countdown")]]
+    graph = FeatureGraph(features)
+    log_assert("Hello Countdown Later Goodbye Other Sub []", feature_names(graph.order), graph.problems())
+    log_assert("['Hello Countdown Later Goodbye', 'Other Sub']", [feature_names(subtree) for subtree in graph.subtrees])
+    log_assert("Other Sub Hello Goodbye Countdown Later", feature_names(FeatureGraph(features[::-1]).order))
+    features = [graph_feature(name, parent) for name, parent in [("C", "A"), ("A", "B"), ("B", "A"), ("D", "Nowhere"), ("E", "D"), ("D", "Feature")]]
+    graph = FeatureGraph(features)
+    log_assert("D E", feature_names(graph.order))
+    log_assert("[('D.fnf.ts.md', 'feature D is defined again (first in D.fnf.ts.md)'), ('D.fnf.ts.md', \"feature D extends Nowhere, which doesn't exist\"), "
+               "('A.fnf.ts.md', 'features extend each other in a cycle: A extends B extends A')]", graph.problems())
+    out = io.StringIO()
+    for path, message in graph.problems(): report_problem(path, message, out)
+    log_assert("Error in A.fnf.ts.md: features extend each other in a cycle: A extends B extends A", out.getvalue().splitlines()[-1])
+
 def test_context():
     print("\ntest_context -------------------------------------------------\n")
     markdown_files = scanFolder(test_folder, ".md")
@@ -1171,19 +3533,435 @@ def test_context():
 #---------------------------------------------------------------------------------
 # test!
 
+# caches go to a temporary folder for the run, so testing and benchmarking leave nothing behind in ~/.cache
+@contextlib.contextmanager
+def temporary_caches():
+    global s_cache_folder, s_parse_cache
+    saved = s_cache_folder, s_parse_cache
+    with tempfile.TemporaryDirectory() as folder:
+        s_cache_folder, s_parse_cache = folder, ParseCache(os.path.join(folder, "parses"))
+        try: yield folder
+        finally: s_cache_folder, s_parse_cache = saved
+
 def test():
-    log_enable()
-    test_parser(Typescript(), test_code_ts, lexemes_ts, ast_ts, print_ts)
-    #test_parser(Python(), test_code_py, lexemes_py, ast_py, print_py)
-    #test_parser(C(), test_code_c, lexemes_c, ast_c, print_c)
+    with temporary_caches():
+        log_enable()
+        test_parser(Typescript(), test_code_ts, lexemes_ts, ast_ts, print_ts)
+        test_parser(Python(), test_code_py, lexemes_py, ast_py, print_py)
+        test_parser(C(), test_code_c, lexemes_c, ast_c, print_c)
+        test_lexer()
+        test_lexer_stress()
+        test_token_buffer()
+        test_token_kinds()
+        test_locations()
+        test_packrat()
+        test_first_sets()
+        test_grammar_cache()
+        test_compiler()
+        test_ast_nodes()
+        test_token_ranges()
+        test_bracket_matches()
+        test_lazy_errors()
+        test_farthest_failure()
+        test_writer()
+        test_text_writer()
+        test_pretty_print()
+        test_profiler()
+        test_iterative()
+        test_extract_ranges()
+        test_fences()
+        test_scan()
+        test_feature_graph()
+        test_parse_cache()
     #test_extract()
     #log_enable()
     #test_context()
 
+#---------------------------------------------------------------------------------
+# benchmarks: "python fnf.py bench"
+
+# best-of-n wall time of fn(), in seconds
+def bench_time(fn, repeat: int=5) -> float:
+    best = None
+    for i in range(0, repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+# many small feature files
+def bench_lexer():
+    print("\nbench_lexer -------------------------------------------------\n")
+    for language, code in [(Typescript(), test_code_ts), (Python(), test_code_py), (C(), test_code_c)]:
+        sources = [SourceFile(None, code * 10) for i in range(0, 200)]
+        nTokens = sum(len(lexer([SourceRange(source)], language.indentChar())) for source in sources)
+        tCharwise = bench_time(lambda: [lexer_charwise([SourceRange(source)], language.indentChar()) for source in sources])
+        tLexer = bench_time(lambda: [lexer([SourceRange(source)], language.indentChar()) for source in sources])
+        name = language.__class__.__name__
+        print(f"{name:12} {nTokens} tokens: charwise {nTokens/tCharwise:10.0f} tokens/sec, lexer {nTokens/tLexer:10.0f} tokens/sec ({tCharwise/tLexer:.1f}x)")
+
+# memory held by ~100k lexemes: Lex objects vs TokenBuffer columns
+def bench_token_buffer():
+    print("\nbench_token_buffer -------------------------------------------------\n")
+    source = SourceFile(None, test_code_ts * 1000)
+    ranges = [SourceRange(source)]
+    tracemalloc.start()
+    lexemes = lexer(ranges)
+    lexBytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    nTokens = len(lexemes)
+    del lexemes
+    tracemalloc.start()
+    buffer = tokenise(ranges)
+    bufferBytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"{nTokens} tokens: Lex list {lexBytes} bytes ({lexBytes/nTokens:.1f}/token), TokenBuffer {bufferBytes} bytes ({bufferBytes/nTokens:.1f}/token)")
+    print(f"saved {lexBytes - bufferBytes} bytes ({100 * (lexBytes - bufferBytes) / lexBytes:.0f}%)")
+
+# the test code with its components repeated (n) times
+def repeat_components(code: str, n: int) -> str:
+    lines = code.strip().split("\n")
+    closed = lines[-1] == "}"
+    components = lines[1:-1] if closed else lines[1:]
+    return "\n".join([lines[0]] + components * n + ([lines[-1]] if closed else []))
+
+# parse time per grammar, on already-lexed input: one big feature, then many small ones
+def bench_parse():
+    print("\nbench_parse -------------------------------------------------\n")
+    for language, code in [(Typescript(), test_code_ts), (Python(), test_code_py), (C(), test_code_c)]:
+        name = language.__class__.__name__
+        parser = feature(language)
+        lexemes = tokenise([SourceRange(SourceFile(None, repeat_components(code, 100)))], language.indentChar())
+        buffers = [tokenise([SourceRange(SourceFile(None, code))], language.indentChar()) for i in range(0, 300)]
+        with contextlib.redirect_stdout(io.StringIO()):
+            ast = parser(Reader(lexemes))
+            tBig = bench_time(lambda: parser(Reader(lexemes)))
+            tSmall = bench_time(lambda: [parser(Reader(buffer)) for buffer in buffers])
+        print(f"{name:12} 1 x {len(lexemes)} tokens, {len(ast['components'])} components: {tBig*1000:.1f} ms ({len(lexemes)/tBig:.0f} tokens/sec)")
+        print(f"{name:12} 300 x {len(buffers[0])} tokens: {tSmall*1000:.1f} ms ({300*len(buffers[0])/tSmall:.0f} tokens/sec)")
+
+# errors and pretty-printing ask for locations all the time: cost per token should stay flat as files grow
+def bench_locations():
+    print("\nbench_locations -------------------------------------------------\n")
+    for n in [25, 100, 400]:
+        lexemes = tokenise([SourceRange(SourceFile(None, repeat_components(test_code_ts, n)))], "{")
+        parser = feature(Typescript())
+        with contextlib.redirect_stdout(io.StringIO()):
+            ast = parser(Reader(lexemes))
+            tParse = bench_time(lambda: parser(Reader(lexemes)), 3)
+        tPretty = bench_time(lambda: pretty_print_ast(ast), 3)
+        print(f"{len(lexemes):7} tokens: parse {tParse*1e6/len(lexemes):6.2f} us/token, pretty_print_ast {tPretty*1e6/len(lexemes):6.2f} us/token")
+
+# packrat on/off: the fnf grammar on a feature full of structs and locals, then the shared-prefix grammar
+def bench_packrat():
+    print("\nbench_packrat -------------------------------------------------\n")
+    components = "\n".join(f"    struct Colour{i} {{ red: number = 0; green: number = 0; }}\n    local c{i}: Colour{i} = new Colour{i}(1, 1);" for i in range(0, 500))
+    cases = [("fnf grammar", feature(Typescript()), f"feature Many extends Feature {{\n{components}\n}}"),
+             ("shared prefix", shared_prefix_grammar(), shared_prefix_code * 500)]
+    for name, parser, code in cases:
+        lexemes = tokenise([SourceRange(SourceFile(None, code))], "{")
+        with contextlib.redirect_stdout(io.StringIO()):
+            tOff = bench_time(lambda: parser(Reader(lexemes)), 3)
+            tOn = bench_time(lambda: parser(Reader(lexemes, packrat=True)), 3)
+            reader = Reader(lexemes, packrat=True)
+            parser(reader)
+        print(f"{name:14} {len(lexemes)} tokens: off {tOff*1000:.1f} ms, on {tOn*1000:.1f} ms; {reader.memo_stats()}")
+
+# parsing lots of small feature files: building the grammar for every file vs once per language
+def bench_startup():
+    global s_parse_cache_enabled
+    print("\nbench_startup -------------------------------------------------\n")
+    with tempfile.TemporaryDirectory() as folder:
+        features = []
+        for i in range(0, 1000):
+            path = os.path.join(folder, f"Small{i}.fnf.ts.md")
+            writeTextFile(path, f"# Small{i}\n\n    feature Small{i} extends Feature {{\n        local count{i}: number = {i};\n    }}\n")
+            features.append(Feature(SourceFile(path)))
+        def parse_all(features, cached: bool):
+            for feature in features:
+                if not cached:
+                    s_grammars.clear()
+                    s_compiled_grammars.clear()
+                feature.parse()
+        # the parse cache would skip the grammar altogether
+        saved, s_parse_cache_enabled = s_parse_cache_enabled, False
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                # rebuilding is slow enough that 100 files, scaled up, is a fair estimate
+                tRebuild = bench_time(lambda: parse_all(features[:100], False), 1) * 10
+                tCached = bench_time(lambda: parse_all(features, True), 3)
+        finally:
+            s_parse_cache_enabled = saved
+    print(f"1000 files: grammar per file ~{tRebuild*1000:.0f} ms, cached grammar {tCached*1000:.0f} ms ({tRebuild/tCached:.0f}x)")
+
+# grammar construction at the bottom of a shallow and a deep stack: should cost the same
+def bench_caller_context():
+    print("\nbench_caller_context -------------------------------------------------\n")
+    def at_depth(depth: int, fn):
+        return fn() if depth == 0 else at_depth(depth-1, fn)
+    for depth in [0, 100, 500]:
+        tCall = bench_time(lambda: at_depth(depth, lambda: [caller_context() for i in range(0, 1000)]))
+        tGrammar = bench_time(lambda: at_depth(depth, lambda: feature(Typescript())))
+        print(f"stack depth {depth:3}: caller_context {tCall*1e6/1000:.2f} us, build Typescript grammar {tGrammar*1000:.2f} ms")
+
+# interpreted combinators vs the compiled grammar, on the same token buffers
+def bench_compiler():
+    print("\nbench_compiler -------------------------------------------------\n")
+    for language, code in [(Typescript(), test_code_ts), (Python(), test_code_py), (C(), test_code_c)]:
+        name = language.__class__.__name__
+        lexemes = tokenise([SourceRange(SourceFile(None, repeat_components(code, 100)))], language.indentChar())
+        interpreted, compiled = grammar(language), compiled_grammar(language)
+        tInterpreted = bench_time(lambda: interpreted(Reader(lexemes)))
+        tCompiled = bench_time(lambda: compiled(Reader(lexemes)))
+        print(f"{name:12} {len(lexemes)} tokens: interpreted {tInterpreted*1000:.1f} ms, compiled {tCompiled*1000:.1f} ms ({tInterpreted/tCompiled:.1f}x)")
+    tCompile = bench_time(lambda: compile_grammar(feature(Typescript())), 3)
+    print(f"compile_grammar(Typescript): {tCompile*1000:.1f} ms")
+
+# the AST of a 50k-line feature, as dicts and as AstNodes: live bytes and blocks, and parse time
+def bench_ast_memory():
+    print("\nbench_ast_memory -------------------------------------------------\n")
+    global s_ast_nodes_enabled
+    code = repeat_components(test_code_ts, 50000 // (test_code_ts.strip().count("\n") - 1))
+    lexemes = tokenise([SourceRange(SourceFile(None, code))], "{")
+    results = []
+    for nodes in [False, True]:
+        s_ast_nodes_enabled = nodes
+        parser = compile_grammar(feature(Typescript()))
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        ast = parser(Reader(lexemes))
+        stats = tracemalloc.take_snapshot().compare_to(before, 'filename')
+        tracemalloc.stop()
+        nBytes, nBlocks = sum(stat.size_diff for stat in stats), sum(stat.count_diff for stat in stats)
+        tParse = bench_time(lambda: parser(Reader(lexemes)), 3)
+        results.append((nBytes, nBlocks))
+        print(f"{"AstNodes" if nodes else "dicts":8} {code.count("\n")+1} lines, {len(lexemes)} tokens: {nBytes/1e6:.1f} MB in {nBlocks} blocks, parse {tParse*1000:.0f} ms")
+        del ast
+    s_ast_nodes_enabled = True
+    (dictBytes, dictBlocks), (nodeBytes, nodeBlocks) = results
+    print(f"saved {100 * (dictBytes - nodeBytes) / dictBytes:.0f}% of bytes, {100 * (dictBlocks - nodeBlocks) / dictBlocks:.0f}% of blocks")
+
+# a TS feature of (nFunctions) functions, each with a body of (nLines) statements
+def big_bodies_code(nLines: int, nFunctions: int) -> str:
+    body = "\n".join(f"        total = total + values[{i}] * scale(x, {i});" for i in range(0, nLines))
+    functions = "\n".join(f"    on f{i}(x: number) : number {{\n{body}\n    }}" for i in range(0, nFunctions))
+    return f"feature Big extends Feature {{\n{functions}\n}}"
+
+# functions with bodies of thousands of tokens: AST bytes with lexeme lists vs TokenRanges
+def bench_token_ranges():
+    print("\nbench_token_ranges -------------------------------------------------\n")
+    for nLines in [100, 1000]:
+        lexemes = tokenise([SourceRange(SourceFile(None, big_bodies_code(nLines, 20)))], "{")
+        parser = compiled_grammar(Typescript())
+        line = f"{nLines} lines ({len(lexemes) // 20} tokens) per body, 20 bodies:"
+        for ranges in [False, True]:
+            tracemalloc.start()
+            ast = parser(Reader(lexemes, ranges=ranges))
+            nBytes = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            tParse = bench_time(lambda: parser(Reader(lexemes, ranges=ranges)), 3)
+            line += f" {"ranges" if ranges else "lists"} {nBytes/1e6:.2f} MB, {tParse*1000:.1f} ms;"
+            del ast
+        print(line)
+
+# with the bracket table, upto() jumps over bodies: parse time follows declarations, not body size
+def bench_upto():
+    print("\nbench_upto -------------------------------------------------\n")
+    parser = compiled_grammar(Typescript())
+    for nLines in [10, 100, 1000, 5000]:
+        lexemes = tokenise([SourceRange(SourceFile(None, big_bodies_code(nLines, 20)))], "{")
+        tParse = bench_time(lambda: parser(Reader(lexemes, ranges=True)))
+        print(f"20 functions x {nLines:4} lines ({len(lexemes):7} tokens): parse {tParse*1e6:6.0f} us ({tParse*1e6/20:.1f} us/function)")
+
+# valid input still fails lots of alternatives on the way; those failures should cost next to nothing
+# "untyped" has 50 parameters per function, each failing both optional(':' type) and optional('=' default)
+def bench_failures():
+    print("\nbench_failures -------------------------------------------------\n")
+    parameters = ", ".join(f"p{i}" for i in range(0, 50))
+    untyped = "feature Many extends Feature {\n" + "\n".join(f"    on f{i}({parameters}) {{\n        return 0;\n    }}" for i in range(0, 200)) + "\n}"
+    cases = [("Typescript", Typescript(), repeat_components(test_code_ts, 100)), ("Python", Python(), repeat_components(test_code_py, 100)),
+             ("C", C(), repeat_components(test_code_c, 100)), ("untyped", Typescript(), untyped)]
+    for name, language, code in cases:
+        lexemes = tokenise([SourceRange(SourceFile(None, code))], language.indentChar())
+        interpreted, compiled = grammar(language), compiled_grammar(language)
+        tInterpreted = bench_time(lambda: interpreted(Reader(lexemes)))
+        tCompiled = bench_time(lambda: compiled(Reader(lexemes)))
+        print(f"{name:12} {len(lexemes)} valid tokens: interpreted {tInterpreted*1000:.1f} ms, compiled {tCompiled*1000:.1f} ms")
+
+# the lexemes a printer writes for (ast)
+def parser_lexemes(parser, ast) -> List[Lex]:
+    writer = Writer()
+    parser(writer, ast)
+    return writer.lexemes
+
+# round-trip printing large ASTs: rollbacks and literals should keep it linear
+def bench_print():
+    print("\nbench_print -------------------------------------------------\n")
+    parser = grammar(Typescript())
+    for n in [25, 100, 400, 1600]:
+        lexemes = tokenise([SourceRange(SourceFile(None, repeat_components(test_code_ts, n)))])
+        ast = parser(Reader(lexemes))
+        tPrint = bench_time(lambda: parser(Writer(), ast), 3)
+        tTwoPass = bench_time(lambda: format_lexemes(parser_lexemes(parser, ast), Typescript()), 3)
+        tStream = bench_time(lambda: parser(TextWriter(io.StringIO(), Typescript()), ast), 3)
+        print(f"{len(lexemes):7} tokens: print {tPrint*1000:7.1f} ms ({tPrint*1e6/len(lexemes):.2f} us/token), "
+              f"text: lexemes+format {tTwoPass*1000:7.1f} ms, streamed {tStream*1000:7.1f} ms")
+
+# pretty_print_ast should cost the same per token however big the feature gets
+def bench_pretty_print():
+    print("\nbench_pretty_print -------------------------------------------\n")
+    parser = grammar(Typescript())
+    for n in [25, 100, 400, 1600]:
+        lexemes = tokenise([SourceRange(SourceFile(None, repeat_components(test_code_ts, n)))])
+        ast = parser(Reader(lexemes, ranges=True))
+        tMarkers = bench_time(lambda: pretty_print_ast_markers(ast), 3)
+        tBuckets = bench_time(lambda: pretty_print_ast(ast), 3)
+        print(f"{len(lexemes):7} tokens: markers {tMarkers*1000:7.1f} ms ({tMarkers*1e6/len(lexemes):.2f} us/token), "
+              f"buckets {tBuckets*1000:7.1f} ms ({tBuckets*1e6/len(lexemes):.2f} us/token)")
+
+# recursive vs iterative engine: the fnf grammar, and a grammar deep enough that only the iterative one copes
+def bench_iterative():
+    print("\nbench_iterative ----------------------------------------------\n")
+    for name, language, code in [("Typescript", Typescript(), repeat_components(test_code_ts, 100)), ("Python", Python(), repeat_components(test_code_py, 100))]:
+        lexemes = tokenise([SourceRange(SourceFile(None, code))], language.indentChar())
+        recursive, iterative = grammar(language), IterativeParser(grammar(language))
+        tRecursive = bench_time(lambda: recursive(Reader(lexemes)))
+        tIterative = bench_time(lambda: iterative(Reader(lexemes)))
+        print(f"{name:12} {len(lexemes)} tokens: recursive {tRecursive*1000:.1f} ms, iterative {tIterative*1000:.1f} ms")
+    for depth in [200, 10000]:
+        parser = nested_grammar(depth)
+        lexemes = tokenise([SourceRange(SourceFile(None, nested_code(depth)))])
+        try:
+            tRecursive = f"{bench_time(lambda: parser(Reader(lexemes)), 3)*1000:.1f} ms"
+        except RecursionError:
+            tRecursive = "RecursionError"
+        tIterative = bench_time(lambda: IterativeParser(parser)(Reader(lexemes)), 3)
+        print(f"nested {depth:6}: recursive {tRecursive}, iterative {tIterative*1000:.1f} ms")
+
+# 10MB of literate feature document: split-into-lines extraction vs regex-scanned, then feeding the lexer
+def bench_extract():
+    print("\nbench_extract ------------------------------------------------\n")
+    code = docs_document(test_code_ts, 1)
+    source = SourceFile(None, "")
+    source.text = docs_document(test_code_ts, 10_000_000 // len(code))
+    nRanges = len(extractCode(source))
+    tSplit = bench_time(lambda: extractCode(source), 3)
+    tScan = bench_time(lambda: [range for range in extract_ranges(source)], 3)
+    tSplitLex = bench_time(lambda: tokenise(extractCode(source)), 3)
+    tScanLex = bench_time(lambda: tokenise(extract_ranges(source), "{", source), 3)
+    mb = len(source.text) / 1e6
+    print(f"{mb:.1f} MB, {nRanges} blocks: extractCode {tSplit*1000:.1f} ms, extract_ranges {tScan*1000:.1f} ms ({mb/tScan:.0f} MB/sec)")
+    print(f"  + tokenise: extractCode {tSplitLex*1000:.1f} ms, extract_ranges {tScanLex*1000:.1f} ms")
+
+# a doc-heavy feature: each component in a ```ts fence, among shell transcripts, JSON samples and pseudocode
+def foreign_document(nComponents: int) -> str:
+    out = "# Colours\n\n```ts\nfeature Colours extends Feature {\n```\n\n"
+    for i in range(0, nComponents):
+        out += (f"Building colour {i}:\n\n```sh\n$ fnf build Colours.fnf.ts.md --colour {i}\nbuilt 1 feature, 3 components in 0.01 sec\n```\n\n"
+                f"```ts\n    struct Colour{i} {{ red: number = 0; green: number = 0; blue: number = 0; }}\n```\n\n"
+                f"It serialises as:\n\n```json\n{{ \"red\": 0, \"green\": 0, \"blue\": 0, \"name\": \"Colour{i}\" }}\n```\n\n"
+                f"Roughly, in python:\n\n```py\nclass Colour{i}:\n    def __init__(self): self.red = self.green = self.blue = 0\n```\n\n")
+    return out
+
+# lexing and parsing everything extractCode finds vs only the ```ts blocks
+def bench_fences():
+    print("\nbench_fences -------------------------------------------------\n")
+    parser = compiled_grammar(Typescript())
+    for n in [100, 1000]:
+        source = SourceFile(None, "")
+        source.text = foreign_document(n)
+        tAllLex = bench_time(lambda: tokenise(extractCode(source)), 3)
+        tTsLex = bench_time(lambda: tokenise(extract_ranges(source, Typescript()), "{", source), 3)
+        allLexemes, tsLexemes = tokenise(extractCode(source)), tokenise(extract_ranges(source, Typescript()), "{", source)
+        tAllParse = bench_time(lambda: parser(Reader(allLexemes)), 3)
+        tTsParse = bench_time(lambda: parser(Reader(tsLexemes)), 3)
+        parsed = "error" if err(parser(Reader(allLexemes))) else "ok"
+        print(f"{len(source.text)/1e6:.2f} MB: all blocks {len(allLexemes)} tokens, lex {tAllLex*1000:.1f} ms, parse {tAllParse*1000:.2f} ms ({parsed}); "
+              f"ts blocks {len(tsLexemes)} tokens, lex {tTsLex*1000:.1f} ms, parse {tTsParse*1000:.2f} ms")
+
+# scanning a 50k-file tree: os.walk plus a stat per file (as scanFolder used to) vs scandir, serial and threaded
+def bench_scan():
+    print("\nbench_scan ---------------------------------------------------\n")
+    with tempfile.TemporaryDirectory() as root:
+        make_tree(root, 50, 20, 50)
+        def walk_and_stat():
+            found = []
+            for folder, folders, files in os.walk(root):
+                found += [os.path.join(folder, file) for file in files if file.endswith(".md")]
+            found.sort(key=lambda file: os.stat(file).st_ctime)
+            return found
+        tWalk = bench_time(walk_and_stat, 3)
+        tScan = bench_time(lambda: scanFolder(root, ".md"), 3)
+        tThreads = bench_time(lambda: scanFolder(root, ".md", 8), 3)
+        print(f"50000 files, {len(scanFolder(root, '.md'))} features: os.walk + stat {tWalk*1000:.1f} ms, scandir {tScan*1000:.1f} ms, scandir x 8 threads {tThreads*1000:.1f} ms")
+
+# parsing a 2000-feature project with no cache, into an empty cache, and from a full one
+def bench_parse_cache():
+    global s_parse_cache, s_parse_cache_enabled
+    print("\nbench_parse_cache --------------------------------------------\n")
+    text = readTextFile("source/test/Hello/Countdown.fnf.ts.md")
+    with tempfile.TemporaryDirectory() as root:
+        for i in range(0, 2000):
+            folder = os.path.join(root, f"f{i // 100}")
+            os.makedirs(folder, exist_ok=True)
+            writeTextFile(os.path.join(folder, f"Countdown{i}.fnf.ts.md"), text.replace("Countdown", f"Countdown{i}"))
+        paths = scanFolder(root, ".md")
+        def parse_all():
+            for path in paths: Feature(SourceFile(path)).parse()
+        saved = s_parse_cache, s_parse_cache_enabled
+        try:
+            s_parse_cache_enabled = False
+            tNone = bench_time(parse_all, 1)
+            s_parse_cache_enabled = True
+            s_parse_cache = ParseCache(os.path.join(root, "cache"))
+            tCold = bench_time(parse_all, 1)
+            tWarm = bench_time(parse_all, 3)
+            cache = s_parse_cache
+        finally:
+            s_parse_cache, s_parse_cache_enabled = saved
+        print(f"{len(paths)} features: no cache {tNone*1000:.0f} ms, cold {tCold*1000:.0f} ms, warm {tWarm*1000:.0f} ms ({tNone/tWarm:.1f}x), {cache.totalBytes // 1024} KB cached")
+
+# building the graph of a random forest of features, given in shuffled order: time per feature should stay flat
+def bench_feature_graph():
+    print("\nbench_feature_graph ------------------------------------------\n")
+    rnd = random.Random(1)
+    for n in [1000, 10000, 40000]:
+        features = [graph_feature(f"F{i}", f"F{rnd.randrange(0, i)}" if i > 0 and rnd.random() < 0.9 else "Feature") for i in range(0, n)]
+        rnd.shuffle(features)
+        tGraph = bench_time(lambda: FeatureGraph(features), 3)
+        graph = FeatureGraph(features)
+        print(f"{n:6} features, {len(graph.subtrees)} subtrees: {tGraph*1000:.1f} ms ({tGraph*1e6/n:.2f} us/feature)")
+
+def bench():
+    with temporary_caches():
+        bench_lexer()
+        bench_token_buffer()
+        bench_parse()
+        bench_locations()
+        bench_packrat()
+        bench_startup()
+        bench_caller_context()
+        bench_compiler()
+        bench_ast_memory()
+        bench_token_ranges()
+        bench_upto()
+        bench_failures()
+        bench_print()
+        bench_pretty_print()
+        bench_iterative()
+        bench_extract()
+        bench_fences()
+        bench_scan()
+        bench_feature_graph()
+        bench_parse_cache()
+
 #---------------------------------------------------------------------------------
 if __name__ == "__main__":
     clear_console()
     print("-----------------------------------------------------------")
     print("ᕦ(ツ)ᕤ fnf.py")
-    test()
+    if "--no-cache" in sys.argv[1:]: s_parse_cache_enabled = False
+    if "bench" in sys.argv[1:]: bench()
+    else: test()
     print("done.")
\ No newline at end of file